@@ -6,67 +6,528 @@ This code is largely borrowed from Kael Hanson.
 
 """
 
+import collections
 import datetime
 import gzip
 import numpy as np
 import os
 import csv
+import queue
+import threading
+import time
+import zlib
 
-from struct import unpack
+from struct import error as struct_error, pack, unpack, unpack_from
 
 
-def decode_ara_blob(f):
-    buf = f.read(8)
-    data_type, station_id, version, subversion, nbytes = unpack("<4Bi", buf)
-    if data_type == 1:
-        return atri_event(station_id, f, buf)
-    else:
-        buf += f.read(nbytes-8)
-        return buf
+#: nominal sampling rate in samples per ns
+sample_rate = 3.2
+
+
+class IncompleteBlob(Exception):
+    """Raised when a buffer ends before the blob being parsed does."""
+
+
+class CorruptBlob(Exception):
+    """Raised for a blob header that cannot be right, e.g. zero padding."""
+
+
+#: size of the generic blob header; no blob is shorter
+min_blob_size = 16
+
+
+#: blob decoders by (data_type, version); version None matches any version
+blob_decoders = {}
+
+
+def register_blob_decoder(data_type, decode, version=None):
+    """Decode blobs of data_type (and version, if given) with decode.
+
+    decode(station_id, buf, offset) is given a buffer holding the whole
+    blob, generic header included, starting at buf[offset].  Blobs without
+    a decoder are skipped.
+    """
+    blob_decoders[data_type, version] = decode
+
+
+def find_blob_decoder(data_type, version, types=None):
+    """Return the decoder for a blob, or None if it should be skipped.
+
+    If types is given, only blobs whose data_type is in it are decoded.
+    """
+    if types is not None and data_type not in types:
+        return None
+    return blob_decoders.get((data_type, version)) \
+            or blob_decoders.get((data_type, None))
+
+
+def record_decoder(dtype):
+    """Return a decoder giving the blob payload as a NumPy record of dtype.
+
+    The payload is everything after the 16 byte blob header; the record is
+    a copy, so it does not keep the read buffer alive.
+    """
+    dtype = np.dtype(dtype)
+    def decode(station_id, buf, offset):
+        return np.frombuffer(buf, dtype, 1, offset + 16).copy()[0]
+    return decode
+
+
+def raw_blob(station_id, buf, offset):
+    """Decoder returning the blob as bytes, as all non-events once were."""
+    nbytes, = unpack_from("<i", buf, offset + 4)
+    return bytes(buf[offset:offset+nbytes])
+
+
+def _decode_atri_event(station_id, buf, offset):
+    # looked up at call time so that instrument.wrap sees these calls
+    return atri_event.from_buffer(station_id, buf, offset)
+
+
+#: data_type of ATRI event blobs
+atri_event_type = 1
+
+register_blob_decoder(atri_event_type, _decode_atri_event)
+
+
+def decode_ara_blob(f, types=None):
+    """Decode the next blob from f that has a decoder.
+
+    Other blobs are skipped by seeking past them rather than reading them.
+    Raises CorruptBlob for a header shorter than min_blob_size.
+    """
+    while True:
+        buf = f.read(8)
+        data_type, station_id, version, subversion, nbytes = \
+                unpack("<4Bi", buf)
+        decode = find_blob_decoder(data_type, version, types)
+        if decode is _decode_atri_event:
+            return atri_event(station_id, f, buf)
+        elif nbytes < min_blob_size:
+            raise CorruptBlob
+        elif decode is None:
+            f.seek(nbytes - 8, os.SEEK_CUR)
+        else:
+            buf += f.read(nbytes - 8)
+            if len(buf) < nbytes:
+                raise EOFError
+            return decode(station_id, buf, 0)
 
 
 class ara_stream(object):
-    def __init__(self, f):
+    def __init__(self, f, types=None):
         """
         Parameters
         ----------
         f : gzip _io.BufferedReader
+        types : container of int
+            if given, only decode blobs with these data types
         """
         self.f = f
+        self.types = types
 
     def __iter__(self):
         return self
 
     def __next__(self):
         try:
-            return decode_ara_blob(self.f)
-        except:
+            return decode_ara_blob(self.f, self.types)
+        except (struct_error, EOFError, CorruptBlob):
             raise StopIteration
 
 
+def parse_ara_blob(buf, offset=0, types=None):
+    """Decode the first blob starting at or after buf[offset] that has a
+    decoder (see find_blob_decoder); other blobs are skipped.
+
+    Returns
+    -------
+    (blob, offset)
+        the decoded blob and the offset just past it
+
+    Raises
+    ------
+    IncompleteBlob
+        if buf ends before the blob does
+    CorruptBlob
+        if a blob header gives a length shorter than min_blob_size
+    """
+    while True:
+        if len(buf) < offset + 8:
+            raise IncompleteBlob
+        data_type, station_id, version, subversion, nbytes = \
+                unpack_from("<4Bi", buf, offset)
+        decode = find_blob_decoder(data_type, version, types)
+        if decode is _decode_atri_event:
+            ev = atri_event.from_buffer(station_id, buf, offset)
+            return ev, offset + len(ev.binary)
+        if nbytes < min_blob_size:
+            raise CorruptBlob
+        if len(buf) < offset + nbytes:
+            raise IncompleteBlob
+        if decode is not None:
+            return decode(station_id, buf, offset), offset + nbytes
+        offset += nbytes
+
+
+_popcount = [bin(i).count('1') for i in range(256)]
+
+
+def parse_ara_header(buf, offset=0, types=None):
+    """Like parse_ara_blob, but only decode event headers.
+
+    Readout samples are skipped without being unpacked.  Returns a tuple
+    matching store_header_dtype for events, or None for other blobs, along
+    with the offset just past the blob.  types is accepted for symmetry
+    with parse_ara_blob and ignored.  Raises IncompleteBlob and CorruptBlob
+    like parse_ara_blob.
+    """
+    if len(buf) < offset + 8:
+        raise IncompleteBlob
+    data_type, station_id, version, subversion, nbytes = \
+            unpack_from("<4Bi", buf, offset)
+    if data_type != 1:
+        if nbytes < min_blob_size:
+            raise CorruptBlob
+        if len(buf) < offset + nbytes:
+            raise IncompleteBlob
+        return None, offset + nbytes
+    o = offset + 16
+    if len(buf) < o + 56:
+        raise IncompleteBlob
+    unix, unix_us, sw_event_id, nb, timestamp, pps, event_id, version_id, \
+            nblk = unpack_from("<q6i2h", buf, o)
+    trigger_info = unpack_from("<4i", buf, o + 36)
+    trigger_blk = unpack_from("4B", buf, o + 52)
+    o += 56
+    for i in range(nblk):
+        if len(buf) < o + 4:
+            raise IncompleteBlob
+        o += 4 + 128 * _popcount[buf[o+2]]
+    if len(buf) < o:
+        raise IncompleteBlob
+    return (tuple(buf[offset:offset+16]), station_id, unix, unix_us,
+            sw_event_id, nb, timestamp, pps, event_id, version_id, nblk,
+            trigger_info, trigger_blk, 0), o
+
+
+class ara_pipelined_stream(object):
+    def __init__(self, f, chunk_size=1 << 22, depth=4, parse=None,
+            types=None):
+        """
+        Parameters
+        ----------
+        f : gzip _io.BufferedReader
+        chunk_size : int
+            number of decompressed bytes per read
+        depth : int
+            number of chunks buffered ahead of the parser
+        parse : function
+            parse_ara_blob (the default) or parse_ara_header
+        types : container of int
+            if given, only decode blobs with these data types
+
+        A background thread fills chunks from f (zlib releases the GIL, so
+        decompression overlaps with parsing); blobs are then parsed from
+        memory by offset.
+        """
+        self.f = f
+        self.chunk_size = chunk_size
+        self.parse = parse
+        self.types = types
+        self._chunks = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._buf = b''
+        self._offset = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self):
+        while not self._stop.is_set():
+            try:
+                chunk = self.f.read(self.chunk_size)
+            except Exception:
+                chunk = b''
+            while not self._stop.is_set():
+                try:
+                    self._chunks.put(chunk, timeout=.1)
+                    break
+                except queue.Full:
+                    pass
+            if not chunk:
+                return
+
+    def close(self):
+        """Stop the reader thread; needed only when stopping early."""
+        self._stop.set()
+        self._thread.join()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                parse = self.parse or parse_ara_blob
+                blob, self._offset = parse(
+                        self._buf, self._offset, self.types)
+                return blob
+            except IncompleteBlob:
+                if self._eof:
+                    raise StopIteration
+            except CorruptBlob:
+                # nothing after this can be found; e.g. trailing padding
+                self.close()
+                raise StopIteration
+            chunk = self._chunks.get()
+            if not chunk:
+                self._eof = True
+            self._buf = self._buf[self._offset:] + chunk
+            self._offset = 0
+
+
+class ara_follow_stream(object):
+    def __init__(self, filename, interval=1., chunk_size=1 << 20,
+            types=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            a .dat file (gzipped or not) that may still be growing
+        interval : float
+            seconds to wait between polls when iterating
+        types : container of int
+            if given, only decode blobs with these data types
+
+        Each poll reads only the bytes appended since the previous one and
+        decompresses them incrementally, so the cost per new event is
+        constant.  self.offset is the decompressed offset just past the last
+        complete blob.
+        """
+        self.filename = filename
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.types = types
+        self.offset = 0
+        self._f = open(filename, 'rb')
+        self._z = None
+        self._gzip = None
+        self._buf = b''
+
+    def _decompress(self, raw):
+        if self._gzip is None:
+            if len(raw) < 2:
+                return b'', raw
+            self._gzip = raw[:2] == b'\x1f\x8b'
+        if not self._gzip:
+            return raw, b''
+        out = []
+        while raw:
+            if self._z is None:
+                self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out.append(self._z.decompress(raw))
+            raw = self._z.unused_data
+            if self._z.eof:
+                # concatenated gzip members, e.g. from appending writers
+                self._z = None
+        return b''.join(out), b''
+
+    def read(self):
+        """Return the decompressed bytes appended since the last read.
+
+        Do not mix with poll(), which keeps incomplete blobs for itself.
+        """
+        pending = b''
+        parts = []
+        while True:
+            raw = self._f.read(self.chunk_size)
+            if not raw:
+                break
+            data, pending = self._decompress(pending + raw)
+            parts.append(data)
+        if pending:
+            # too short to tell whether it is gzipped; try again next time
+            self._f.seek(-len(pending), os.SEEK_CUR)
+        return b''.join(parts)
+
+    def poll(self):
+        """Return the complete blobs that appeared since the last poll."""
+        buf = self._buf + self.read()
+        blobs = []
+        o = 0
+        while True:
+            try:
+                blob, o = parse_ara_blob(buf, o, self.types)
+            except (IncompleteBlob, CorruptBlob):
+                break
+            blobs.append(blob)
+        self._buf = buf[o:]
+        self.offset += o
+        return blobs
+
+    def close(self):
+        self._f.close()
+
+    def __iter__(self):
+        while True:
+            blobs = self.poll()
+            if not blobs:
+                time.sleep(self.interval)
+            for blob in blobs:
+                yield blob
+
+
+class ara_event_list(object):
+    """The events of a .dat file, decoded only when used.
+
+    Only headers are decoded up front (see parse_ara_header); self.headers
+    is their store_header_dtype table.  The decompressed data stays in
+    memory and events are decoded from it on access, keeping the most
+    recently used ones.
+    """
+
+    cache_size = 64
+
+    def __init__(self):
+        self.headers = np.zeros(0, store_header_dtype)
+        self._chunks = []
+        self._where = []
+        self._tail = b''
+        self._corrupt = False
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, filename):
+        self = cls()
+        with open_ara_file(filename) as f:
+            self.append_bytes(f.read())
+        return self
+
+    def append_bytes(self, data):
+        """Scan data appended to the file; return the number of new events.
+
+        data need not end on a blob boundary, e.g. ara_follow_stream.read().
+        """
+        buf = self._tail + data
+        rows = []
+        where = []
+        o = 0
+        while not self._corrupt:
+            try:
+                row, end = parse_ara_header(buf, o)
+            except IncompleteBlob:
+                break
+            except CorruptBlob:
+                # nothing after this can be found; e.g. trailing padding
+                self._corrupt = True
+                break
+            if row is not None:
+                rows.append(row)
+                where.append((len(self._chunks), o))
+            o = end
+        if rows:
+            self._chunks.append(buf)
+            self._where.extend(where)
+            self.headers = np.concatenate(
+                [self.headers, np.array(rows, store_header_dtype)])
+        self._tail = buf[o:]
+        return len(rows)
+
+    def __len__(self):
+        return len(self._where)
+
+    def _decode(self, i):
+        chunk, offset = self._where[i]
+        station_id = int(self.headers['station_id'][i])
+        return atri_event.from_buffer(station_id, self._chunks[chunk], offset)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        with self._lock:
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+        ev = self._decode(i)
+        with self._lock:
+            self._cache[i] = ev
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ev
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._decode(i)
+
+
 class atri_event(object):
     def __init__(self, station_id, f, buf):
         binary_parts = [buf]
         self.station_id = station_id
         buf = f.read (8)
         binary_parts.append (buf)
-        buf = f.read(36)
+        buf = f.read(56)
         binary_parts.append (buf)
-        self.unix, self.unix_us, self.sw_event_id, nb, self.timestamp, \
-                self.pps, self.event_id, self.version_id, self.nblk = \
-                unpack("<q6i2h", buf)
-        buf = f.read(16)
-        binary_parts.append (buf)
-        self.trigger_info = unpack("<4i", buf)
-        buf = f.read(4)
-        binary_parts.append (buf)
-        self.trigger_blk  = unpack("4B", buf)
+        self._unpack_header(buf, 0)
         self.readouts     = []
         for i in range(self.nblk):
             self.readouts.append(atri_readout(f)) 
             binary_parts.append (self.readouts[-1].binary)
         self.binary = b''.join (binary_parts)
 
+    @classmethod
+    def from_buffer(cls, station_id, buf, offset):
+        """Parse an event from buf[offset:] without any file reads."""
+        self = cls.__new__(cls)
+        self.station_id = station_id
+        o = offset + 16
+        if len(buf) < o + 56:
+            raise IncompleteBlob
+        self._unpack_header(buf, o)
+        o += 56
+        # find the end first, so that the readouts can share one copy
+        for i in range(self.nblk):
+            if len(buf) < o + 4:
+                raise IncompleteBlob
+            o += 4 + 128 * _popcount[buf[o+2]]
+        if len(buf) < o:
+            raise IncompleteBlob
+        self.binary = bytes(buf[offset:o])
+        self.readouts = []
+        o = 72
+        for i in range(self.nblk):
+            r = atri_readout.from_buffer(self.binary, o)
+            self.readouts.append(r)
+            o += len(r.binary)
+        return self
+
+    def _unpack_header(self, buf, o):
+        self.unix, self.unix_us, self.sw_event_id, self.nb, self.timestamp, \
+                self.pps, self.event_id, self.version_id, self.nblk = \
+                unpack_from("<q6i2h", buf, o)
+        self.trigger_info = unpack_from("<4i", buf, o + 36)
+        self.trigger_blk  = unpack_from("4B", buf, o + 52)
+
+    def _set_header_row(self, h):
+        """Set header attributes from a store_header_dtype row."""
+        self.station_id = int(h['station_id'])
+        self.unix = int(h['unix'])
+        self.unix_us = int(h['unix_us'])
+        self.sw_event_id = int(h['sw_event_id'])
+        self.nb = int(h['nb'])
+        self.timestamp = int(h['timestamp'])
+        self.pps = int(h['pps'])
+        self.event_id = int(h['event_id'])
+        self.version_id = int(h['version_id'])
+        self.nblk = int(h['nblk'])
+        self.trigger_info = tuple(int(x) for x in h['trigger_info'])
+        self.trigger_blk = tuple(int(x) for x in h['trigger_blk'])
+
     def get_waveform(self, dda, ch, cal):
         w = np.zeros(int(self.nblk / 4 * 64), 'd')
         ix0 = 0
@@ -76,6 +537,57 @@ class atri_event(object):
             ix0 += 64
         return w
 
+    def get_block_samples(self):
+        """Return the raw samples of every readout block as arrays.
+
+        Returns
+        -------
+        irs_blk : (nblk,) int array
+        nch : (nblk,) int array
+            number of channels present in each block's mask
+        samples : (nblk, 8, 64) int16 array
+            samples[i,c] is the c-th channel present in block i; rows
+            c >= nch[i] are zero
+        """
+        samples = np.zeros((self.nblk, 8, 64), np.int16)
+        irs_blk = np.empty(self.nblk, int)
+        nch = np.empty(self.nblk, int)
+        for i, r in enumerate(self.readouts):
+            irs_blk[i] = r.irs_blk
+            nch[i] = len(r.samples)
+            samples[i, :nch[i]] = r.samples
+        return irs_blk, nch, samples
+
+    def get_waveforms(self, cal, channels=range(8), tcal=None):
+        """Return pedestal-subtracted waveforms for all DDAs at once.
+
+        Parameters
+        ----------
+        cal : ped_cal
+        channels : sequence of int
+        tcal : time_cal
+            if given, resample onto a uniform sample_rate grid
+
+        Returns
+        -------
+        (len(channels), 4, nblk/4*64) array
+            without tcal, element [i, dda] equals
+            get_waveform(dda, channels[i], cal); blocks in which channel
+            channels[i] was not read out (get_waveform raises IndexError)
+            are zero rather than minus the pedestal
+        """
+        irs_blk, nch, samples = self.get_block_samples()
+        n = self.nblk // 4
+        dda = np.arange(4 * n) % 4
+        absent = np.arange(8) >= nch[:4*n,None]
+        w = samples[:4*n] - cal.ped[dda, irs_blk[:4*n]]
+        w[absent] = 0
+        if tcal is not None:
+            w = tcal.resample(w, dda, irs_blk[:4*n])
+            w[absent] = 0
+        w = w.reshape(n, 4, 8, 64).transpose(2, 1, 0, 3).reshape(8, 4, 64*n)
+        return w[list(channels)]
+
     def get_unix_datetime (self):
         t = datetime.datetime.utcfromtimestamp (self.unix + 1e-6 * self.unix_us)
         return t
@@ -87,22 +599,46 @@ class atri_event(object):
 
 
 class atri_readout(object):
+    """One readout block.
+
+    samples is an (nch, 64) int16 array holding the channels set in the
+    low byte of mask, in order; it is a read-only view of binary.
+    """
+
     def __init__(self, f: bytes):
-        binary_parts = []
         buf = f.read (4)
-        binary_parts.append (buf)
         self.irs_blk, self.mask = unpack("<2h", buf)
-        self.samples = [ ]
-        for i in range(8):
-            if self.mask >> i & 1 == 1:
-                # Checks if the ith bit in the bitmask is set/true
-                buf = f.read(128)
-                binary_parts.append (buf)
-                self.samples.append(unpack("<64h", buf))
-        self.binary = b''.join (binary_parts)
+        nch = _popcount[self.mask & 0xff]
+        data = f.read (128 * nch)
+        if len (data) < 128 * nch:
+            raise EOFError
+        self.binary = buf + data
+        self.samples = np.frombuffer(
+            self.binary, '<i2', 64 * nch, 4).reshape(nch, 64)
+
+    @classmethod
+    def from_buffer(cls, buf, offset):
+        """Parse a readout from buf[offset:] without any file reads.
+
+        samples is a view of buf, which must therefore not change.
+        """
+        self = cls.__new__(cls)
+        if len(buf) < offset + 4:
+            raise IncompleteBlob
+        self.irs_blk, self.mask = unpack_from("<2h", buf, offset)
+        nch = _popcount[self.mask & 0xff]
+        end = offset + 4 + 128 * nch
+        if len(buf) < end:
+            raise IncompleteBlob
+        self.samples = np.frombuffer(
+            buf, '<i2', 64 * nch, offset + 4).reshape(nch, 64)
+        self.binary = memoryview(buf)[offset:end]
+        return self
 
 
 class ped_cal(object):
+    filename = None
+
     def __init__(self, f=None):
         self.ped = np.zeros([4, 512, 8, 64], 'd')
         if f is None: return
@@ -111,3 +647,293 @@ class ped_cal(object):
             ir = [int(x) for x in r]
             chip, block, ch = ir[0:3]
             self.ped[chip, block, ch, :] = np.array(ir[3:], 'd')
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load pedestals from a text file or a binary .npy table."""
+        if filename.endswith('.npy'):
+            cal = cls()
+            cal.ped[...] = np.load(filename)
+        else:
+            with open(filename) as f:
+                cal = cls(f)
+        cal.filename = filename
+        return cal
+
+    def write(self, filename):
+        """Write pedestals as text, or as a binary table for .npy names."""
+        if filename.endswith('.npy'):
+            np.save(filename, self.ped)
+            return
+        ped = np.round(self.ped).astype(int)
+        with open(filename, 'w') as f:
+            for chip in range(4):
+                for block in range(512):
+                    for ch in range(8):
+                        f.write(' '.join(map(str,
+                            [chip, block, ch] + ped[chip, block, ch].tolist())))
+                        f.write('\n')
+
+
+class time_cal(object):
+    filename = None
+
+    def __init__(self, f=None):
+        """
+        Parameters
+        ----------
+        f : file
+            text lines "dda irs_blk ch t0 ... t63", giving the time (ns) of
+            each sample relative to the start of its block; blocks that
+            are not listed keep uniform 1/sample_rate spacing
+        """
+        self.times = np.tile(np.arange(64) / sample_rate, (4, 512, 8, 1))
+        if f is not None:
+            for r in csv.reader(f, delimiter=' '):
+                chip, block, ch = [int(x) for x in r[0:3]]
+                self.times[chip, block, ch, :] = [float(x) for x in r[3:]]
+        self._precompute()
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load sample times from a text file or a binary .npy table."""
+        if filename.endswith('.npy'):
+            cal = cls()
+            cal.times[...] = np.load(filename)
+            cal._precompute()
+        else:
+            with open(filename) as f:
+                cal = cls(f)
+        cal.filename = filename
+        return cal
+
+    def _precompute(self):
+        """Tabulate linear interpolation onto the uniform grid.
+
+        For every (dda, irs_blk, ch) and uniform sample j, idx is the last
+        measured sample at or before j / sample_rate and frac the weight of
+        the sample after it.  Index 64 stands for the first sample of the
+        next block of the same DDA, assumed to follow one nominal block
+        period after this block's first sample.
+        """
+        u = np.arange(64) / sample_rate
+        period = 64 / sample_rate
+        t = np.concatenate([self.times, period + self.times[...,:1]], -1)
+        self.idx = np.empty(self.times.shape, np.int8)
+        self.frac = np.empty(self.times.shape, np.float32)
+        for dda in range(4):
+            td = t[dda]
+            idx = (td[...,None,:] <= u[:,None]).sum(-1) - 1
+            idx = np.clip(idx, 0, 63)
+            t_lo = np.take_along_axis(td, idx, -1)
+            t_hi = np.take_along_axis(td, idx + 1, -1)
+            frac = (u - t_lo) / np.where(t_hi > t_lo, t_hi - t_lo, 1)
+            self.idx[dda] = idx
+            self.frac[dda] = np.clip(frac, 0, 1)
+
+    def resample(self, w, dda, irs_blk):
+        """Interpolate pedestal-subtracted blocks onto the uniform grid.
+
+        Parameters
+        ----------
+        w : (nblk, 8, 64) array
+            blocks in readout order, as in atri_event.get_block_samples()
+        dda, irs_blk : (nblk,) int arrays
+        """
+        nxt = np.empty(w.shape[:2] + (1,), w.dtype)
+        nxt[:-4,:,0] = w[4:,:,0]
+        nxt[-4:,:,0] = w[-4:,:,63]
+        ext = np.concatenate([w, nxt], axis=-1)
+        idx = self.idx[dda, irs_blk].astype(np.intp)
+        lo = np.take_along_axis(ext, idx, -1)
+        hi = np.take_along_axis(ext, idx + 1, -1)
+        return lo + self.frac[dda, irs_blk] * (hi - lo)
+
+
+def open_ara_file(filename):
+    """Open a .dat file for reading, gzipped or not."""
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.GzipFile(filename)
+    return open(filename, 'rb')
+
+
+# Columnar event store
+#
+# A store is a directory holding three files:
+#
+#   headers.npy  one store_header_dtype row per event
+#   blocks.npy   one store_block_dtype row per readout block
+#   samples.i16  every sample of every block, contiguous little-endian int16
+#
+# All three are read through np.memmap, so repeated passes over a run read
+# pages straight from the page cache instead of gunzipping and unpacking.
+
+store_header_dtype = np.dtype([
+    ('prefix', 'u1', 16),
+    ('station_id', 'u1'),
+    ('unix', '<i8'),
+    ('unix_us', '<i4'),
+    ('sw_event_id', '<i4'),
+    ('nb', '<i4'),
+    ('timestamp', '<i4'),
+    ('pps', '<i4'),
+    ('event_id', '<i4'),
+    ('version_id', '<i2'),
+    ('nblk', '<i2'),
+    ('trigger_info', '<i4', 4),
+    ('trigger_blk', 'u1', 4),
+    ('blk_offset', '<i8'),
+])
+
+store_block_dtype = np.dtype([
+    ('irs_blk', '<i2'),
+    ('mask', '<i2'),
+    ('sample_offset', '<i8'),
+])
+
+
+def read_headers(filename):
+    """Return the store_header_dtype header table of a .dat file.
+
+    Only headers are decoded, which is much faster than reading events.
+    """
+    stream = ara_pipelined_stream(open_ara_file(filename),
+                                  parse=parse_ara_header)
+    return np.array([h for h in stream if h is not None],
+                    store_header_dtype)
+
+
+def header_row(ev, blk_offset=0):
+    """Return ev's header as a tuple matching store_header_dtype."""
+    return (np.frombuffer(ev.binary[:16], 'u1'), ev.station_id,
+            ev.unix, ev.unix_us, ev.sw_event_id, ev.nb,
+            ev.timestamp, ev.pps, ev.event_id, ev.version_id,
+            ev.nblk, ev.trigger_info, ev.trigger_blk, blk_offset)
+
+
+def write_store(infiles, dirname):
+    """Convert .dat files into a columnar event store.
+
+    Parameters
+    ----------
+    infiles : list of str
+        .dat files (gzipped or not), concatenated in the given order
+    dirname : str
+        output directory; created if it does not exist
+
+    Returns
+    -------
+    int
+        the number of events written
+    """
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    headers = []
+    blocks = []
+    n_samples = 0
+    with open(os.path.join(dirname, 'samples.i16'), 'wb') as out:
+        for infile in infiles:
+            for ev in ara_pipelined_stream(open_ara_file(infile)):
+                if not isinstance(ev, atri_event):
+                    continue
+                headers.append(header_row(ev, len(blocks)))
+                for r in ev.readouts:
+                    blocks.append((r.irs_blk, r.mask, n_samples))
+                    out.write(r.binary[4:])
+                    n_samples += 64 * len(r.samples)
+    np.save(os.path.join(dirname, 'headers.npy'),
+            np.array(headers, store_header_dtype))
+    np.save(os.path.join(dirname, 'blocks.npy'),
+            np.array(blocks, store_block_dtype))
+    return len(headers)
+
+
+class ara_store(object):
+    def __init__(self, dirname):
+        """
+        Parameters
+        ----------
+        dirname : str
+            a directory written by write_store()
+        """
+        self.headers = np.load(
+            os.path.join(dirname, 'headers.npy'), mmap_mode='r')
+        self.blocks = np.load(
+            os.path.join(dirname, 'blocks.npy'), mmap_mode='r')
+        filename = os.path.join(dirname, 'samples.i16')
+        if os.path.getsize(filename):
+            self.samples = np.memmap(filename, '<i2', mode='r')
+        else:
+            self.samples = np.zeros(0, '<i2')
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, i):
+        return stored_event(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield stored_event(self, i)
+
+
+class stored_event(atri_event):
+    def __init__(self, store, i):
+        h = store.headers[i]
+        self._set_header_row(h)
+        self._store = store
+        self._prefix = h['prefix'].tobytes()
+        b0 = int(h['blk_offset'])
+        self._blocks = store.blocks[b0:b0+self.nblk]
+
+    @property
+    def readouts(self):
+        return [stored_readout(self._store, b) for b in self._blocks]
+
+    @property
+    def binary(self):
+        parts = [self._prefix, pack("<q6i2h",
+            self.unix, self.unix_us, self.sw_event_id, self.nb,
+            self.timestamp, self.pps, self.event_id, self.version_id,
+            self.nblk)]
+        parts.append(pack("<4i", *self.trigger_info))
+        parts.append(pack("4B", *self.trigger_blk))
+        parts.extend(r.binary for r in self.readouts)
+        return b''.join(parts)
+
+    def get_waveform(self, dda, ch, cal):
+        blocks = self._blocks[dda:self.nblk:4]
+        nch = [bin(m & 0xff).count('1') for m in blocks['mask']]
+        if ch >= min(nch, default=8):
+            raise IndexError('channel {0} not read out'.format(ch))
+        idx = blocks['sample_offset'][:,None] + 64 * ch + np.arange(64)
+        w = self._store.samples[idx] - cal.ped[dda, blocks['irs_blk'], ch]
+        return w.ravel()
+
+    def get_block_samples(self):
+        blocks = self._blocks
+        nch = np.array([bin(m & 0xff).count('1') for m in blocks['mask']],
+                       int)
+        samples = np.zeros((self.nblk, 8, 64), np.int16)
+        for i, b in enumerate(blocks):
+            i0 = int(b['sample_offset'])
+            samples[i, :nch[i]] = self._store.samples[
+                i0:i0+64*nch[i]].reshape(nch[i], 64)
+        return blocks['irs_blk'].astype(int), nch, samples
+
+
+class stored_readout(atri_readout):
+    def __init__(self, store, block):
+        self.irs_blk = int(block['irs_blk'])
+        self.mask = int(block['mask'])
+        nch = bin(self.mask & 0xff).count('1')
+        i0 = int(block['sample_offset'])
+        self._samples = store.samples[i0:i0+64*nch]
+        self.samples = list(self._samples.reshape(nch, 64))
+
+    @property
+    def binary(self):
+        return pack("<2h", self.irs_blk, self.mask) \
+                + self._samples.astype('<i2').tobytes()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# benchmark.py
+
+
+from __future__ import print_function
+
+__doc__ = """Time decoding, calibration, analysis and plotting on synthetic data.
+
+Synthetic data and pedestals are generated with synth_data into a scratch
+directory, each stage is timed several times, and the results are written as
+JSON so that runs can be compared over time.
+"""
+
+import contextlib
+import datetime
+import gzip
+import io
+import json
+import numpy as np
+import optparse
+import os
+import platform
+import scipy.signal
+import shutil
+import sys
+import tempfile
+import time
+
+import aradecode
+import select_events
+import synth_data
+import xcorr
+from vars_class import Vars
+
+
+class _Toggle (object):
+
+    """Stand-in for a Gtk.ToggleAction."""
+
+    def __init__ (self, active):
+        self.active = active
+
+    def get_active (self):
+        return self.active
+
+
+def headless_window (events, cal):
+    """Return an event_plots.EventPlots that plots without any GTK widgets."""
+    import event_plots
+    window = event_plots.EventPlots ()
+    window.cal = cal
+    window.tcal = None
+    window.dsm = Vars ()
+    window.dsm.events = events
+    window.menu = Vars ()
+    window.menu.equally_action = _Toggle (True)
+    window.menu.mean_action = _Toggle (False)
+    window.menu.bands_action = _Toggle (True)
+    window.menu.filter_action = _Toggle (False)
+    window._get_selected_event_number = lambda: 0
+    window._get_selected_event_numbers = lambda: range (len (events))
+    return window
+
+def timeit (func, repeat):
+    """Call func repeat times; return the best and mean wall time."""
+    times = []
+    for i in range (repeat):
+        t0 = time.perf_counter ()
+        func ()
+        times.append (time.perf_counter () - t0)
+    return dict (best=min (times), mean=float (np.mean (times)),
+            repeat=repeat)
+
+
+class Benchmark (object):
+
+    def __init__ (self, opts, workdir):
+        self.opts = opts
+        self.workdir = workdir
+        self.results = {}
+
+    def path (self, name):
+        return os.path.join (self.workdir, name)
+
+    def record (self, name, func, n_items=1, repeat=None):
+        """Time func and store the result under name."""
+        result = timeit (func, repeat or self.opts.repeat)
+        result['n_items'] = n_items
+        result['per_item_us'] = 1e6 * result['best'] / n_items
+        self.results[name] = result
+        print ('{0:32s} {1:10.4f} s  {2:12.1f} us/item'.format (
+            name, result['best'], result['per_item_us']))
+
+    def skip (self, name, reason):
+        self.results[name] = dict (skipped=str (reason))
+        print ('{0:32s} skipped: {1}'.format (name, reason))
+
+    def setup (self):
+        opts = self.opts
+        ped = synth_data.make_pedestals (opts.seed)
+        synth_data.write_pedestals (self.path ('pedestals.dat'), ped)
+        for name, gzipped in (('ev.dat', True), ('ev_raw.dat', False)):
+            synth_data.write_dat (self.path (name), ped,
+                    n_events=opts.n_events, station_id=opts.station_id,
+                    nblk=opts.nblk, gzipped=gzipped, seed=opts.seed)
+
+    def run (self):
+        opts = self.opts
+        n = opts.n_events
+        ev_dat = self.path ('ev.dat')
+
+        self.record ('ara_stream', lambda: list (
+            aradecode.ara_stream (gzip.GzipFile (ev_dat))), n)
+        self.record ('ara_stream_uncompressed', lambda: list (
+            aradecode.ara_stream (open (self.path ('ev_raw.dat'), 'rb'))), n)
+        self.record ('ara_pipelined_stream', lambda: list (
+            aradecode.ara_pipelined_stream (gzip.GzipFile (ev_dat))), n)
+
+        def load_cal ():
+            with open (self.path ('pedestals.dat')) as f:
+                return aradecode.ped_cal (f)
+        self.record ('ped_cal', load_cal)
+
+        cal = load_cal ()
+        events = list (aradecode.ara_stream (gzip.GzipFile (ev_dat)))
+        def get_waveforms ():
+            for ev in events:
+                for dda in range (4):
+                    for ch in range (8):
+                        ev.get_waveform (dda, ch, cal)
+        self.record ('get_waveform', get_waveforms, 32 * n)
+
+        try:
+            window = headless_window (events, cal)
+        except Exception as e:
+            window = None
+            for name in ('_get_ws', 'render_wf', 'render_fft',
+                    'render_hilbert', 'render_xcorr', 'render_overlay'):
+                self.skip (name, 'event_plots unavailable ({0})'.format (e))
+            ws = np.array ([[[ev.get_waveform (dda, ch, cal)
+                for dda in range (4)] for ch in range (4)]
+                for ev in events])
+        else:
+            self.record ('_get_ws', lambda: [
+                window._get_ws (ev) for ev in events], n)
+            ws = np.array ([window._get_ws (ev) for ev in events])
+
+        self.record ('rfft', lambda: np.fft.rfft (ws), n)
+        self.record ('hilbert', lambda: scipy.signal.hilbert (ws), n)
+        self.record ('xcorr', lambda: xcorr.cross_correlate (
+            ws.reshape (n, -1, ws.shape[-1])), n)
+
+        def select ():
+            with contextlib.redirect_stdout (io.StringIO ()):
+                select_events.Select ().run ([self.path ('selected'), ev_dat])
+        self.record ('select_events', select, n)
+
+        if window is not None:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+            def render (plot):
+                fig = Figure (figsize=(11, 9))
+                canvas = FigureCanvasAgg (fig)
+                plot (fig)
+                canvas.draw ()
+            self.record ('render_wf', lambda: render (window._plot_event_wf))
+            self.record ('render_fft', lambda: render (
+                lambda fig: window._plot_event_fft (fig, log=False)))
+            self.record ('render_hilbert', lambda: render (
+                window._plot_event_hilbert))
+            self.record ('render_xcorr', lambda: render (
+                window._plot_event_xcorr))
+            self.record ('render_overlay', lambda: render (
+                lambda fig: window._plot_event_overlay (fig, spectra=False)),
+                n)
+
+
+def main ():
+    usage = '%prog {[options]}'
+    parser = optparse.OptionParser (usage=usage, description=__doc__)
+    parser.add_option ('-n', '--n-events', dest='n_events',
+            default=200, type=int, metavar='N',
+            help='number of synthetic events')
+    parser.add_option ('-b', '--nblk', dest='nblk',
+            default=32, type=int, metavar='N',
+            help='readout blocks per event')
+    parser.add_option ('-s', '--station', dest='station_id',
+            default=2, type=int, metavar='ID',
+            help='station id')
+    parser.add_option ('-r', '--repeat', dest='repeat',
+            default=3, type=int, metavar='N',
+            help='time each stage N times and keep the best')
+    parser.add_option ('--seed', dest='seed',
+            default=0, type=int, metavar='SEED',
+            help='random seed for the synthetic data')
+    parser.add_option ('-o', '--output', dest='output',
+            default='', metavar='FILE',
+            help='write JSON results to FILE (default: stdout)')
+    parser.add_option ('-k', '--keep', dest='keep',
+            default='', metavar='DIR',
+            help='generate data in DIR and keep it')
+
+    opts, args = parser.parse_args ()
+    if args:
+        parser.error ('unexpected arguments')
+
+    if opts.keep:
+        if not os.path.isdir (opts.keep):
+            os.makedirs (opts.keep)
+        workdir = opts.keep
+    else:
+        workdir = tempfile.mkdtemp (prefix='pyaradisplay_bench_')
+    try:
+        bench = Benchmark (opts, workdir)
+        bench.setup ()
+        bench.run ()
+    finally:
+        if not opts.keep:
+            shutil.rmtree (workdir)
+
+    report = dict (
+            time=datetime.datetime.utcnow ().isoformat (),
+            python=platform.python_version (),
+            numpy=np.__version__,
+            platform=platform.platform (),
+            params=dict (n_events=opts.n_events, nblk=opts.nblk,
+                station_id=opts.station_id, repeat=opts.repeat,
+                seed=opts.seed),
+            results=bench.results)
+    if opts.output:
+        with open (opts.output, 'w') as f:
+            json.dump (report, f, indent=2, sort_keys=True)
+        print ('Wrote results to "{0}".'.format (opts.output))
+    else:
+        json.dump (report, sys.stdout, indent=2, sort_keys=True)
+        print ()
+
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,322 @@
+# event_plots.py
+
+"""Matplotlib plots of one or more ARA events.
+
+EventPlots draws into any matplotlib Figure and needs no GTK, so its plots
+can be rendered with the Agg backend, e.g. by benchmark.py; pyaradisplay's
+Window inherits them.
+"""
+
+import matplotlib as mpl
+import matplotlib.ticker
+from matplotlib.collections import LineCollection
+import numpy as np
+import scipy.signal
+
+import aradecode
+import xcorr
+
+
+def minmax_decimate (x, y, width):
+    """Reduce y[..., n] to a min/max pair per pixel column of an axis.
+
+    Returns (x, y) unchanged if there are fewer than two points per column;
+    otherwise about 2 * width points, whose line covers the same envelope
+    as the full-resolution one.
+    """
+    n = y.shape[-1]
+    k = int (n // max (width, 1))
+    if k < 2:
+        return x, y
+    n_bins = -(-n // k)
+    pad = n_bins * k - n
+    if pad:
+        x = np.pad (x, (0, pad), mode='edge')
+        y = np.pad (y, [(0, 0)] * (y.ndim - 1) + [(0, pad)], mode='edge')
+    y = y.reshape (y.shape[:-1] + (n_bins, k))
+    y = np.stack ((y.min (axis=-1), y.max (axis=-1)), axis=-1)
+    x = np.repeat (x.reshape (n_bins, k).mean (axis=-1), 2)
+    return x, y.reshape (y.shape[:-2] + (2 * n_bins,))
+
+
+class EventPlots (object):
+
+    """Event plots for a window-like object.
+
+    Subclasses (or callers) provide cal, tcal, filters, dsm.events, the
+    menu toggles equally_action, mean_action, bands_action and filter_action,
+    and _get_selected_event_number() / _get_selected_event_numbers().
+    """
+
+    channels = {}
+    channels[100] = [0, 1, 2, 3]
+    channels[2] = [3, 1, 2, 0]
+    channels[3] = [2, 0, 3, 1]
+    channels[4] = [3, 1, 2, 0]
+    channel_labels = ['Top Hpol', 'Top Vpol', 'Bottom Hpol', 'Bottom Vpol']
+
+    subplot_args = dict (top=.94, bottom=.05, left=.09, right=.98,
+                hspace=0.02, wspace=0.02)
+
+    #: at most this many events are drawn by the overlay plots
+    overlay_max_events = 1000
+    #: lower and upper percentile of the overlay bands
+    overlay_percentiles = (5, 95)
+
+    def _get_ws (self, ev):
+        # with a timing calibration, waveforms are resampled onto a uniform
+        # aradecode.sample_rate grid; otherwise that grid is approximate
+        ws = ev.get_waveforms (self.cal, self.channels[ev.station_id],
+                tcal=self.tcal)
+        if self.menu.mean_action.get_active ():
+            ws = (ws.T - ws.mean (axis=-1).T).T
+        if self.menu.filter_action.get_active ():
+            ws = self.filters (ws)
+        return ws
+
+    def _plot_event_wf (self, fig):
+        n = self._get_selected_event_number ()
+        ev = self.dsm.events[n]
+        station = ev.station_id
+
+        fig.clf ()
+        ws = self._get_ws (ev)
+        y_extrema = np.max (np.max (np.abs (ws), axis=-1), axis=1)
+        for chan in range (4):
+            for dda in range (4):
+                which = 4 * chan + dda + 1
+                ax = fig.add_subplot (4, 4, which)
+                w = ws[chan][dda]
+                t = np.arange (len (w)) / aradecode.sample_rate  # see _get_ws
+                ax.plot (t, w, '-', lw=.5)
+                ax.xaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=4))
+                ax.yaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=6, symmetric=True))
+                if chan < 3:
+                    ax.set_xticklabels ([])
+                if dda > 0:
+                    ax.set_yticklabels ([])
+                # NOTE: this works because we do not account for cable delays
+                ax.set_xlim (0, t.max ())
+                if self.menu.equally_action.get_active ():
+                    ax.set_ylim (-y_extrema[chan], y_extrema[chan])
+                else:
+                    ax.set_yticklabels ([])
+                    extremum = max (ax.get_ylim ())
+                    ax.set_ylim (-extremum, extremum)
+                ax.grid (color='.7', zorder=-10)
+                if dda == 0:
+                    ax.set_ylabel (self.channel_labels[chan])
+                if chan == 0:
+                    ax.set_title ('DDA {0}'.format (dda + 1))
+        fig.subplots_adjust (**self.subplot_args)
+
+    def _plot_event_fft (self, fig, log):
+        n = self._get_selected_event_number ()
+        ev = self.dsm.events[n]
+
+        fig.clf ()
+
+        def get_fft (w):
+            basic_amplitudes = np.fft.rfft (w)
+            amplitudes = basic_amplitudes.T[:-1].T
+            return amplitudes
+
+        def get_fftfreqs (w):
+            t_range = len (w) / aradecode.sample_rate  # ns
+            n = len (w)
+            dt = 1e-9 * t_range / n
+            frequencies = np.fft.fftfreq (n)[:n//2] / dt # Hz
+            return frequencies
+
+        ws = self._get_ws (ev)
+        ffts = np.abs (get_fft (ws)).T[1:].T
+        fftfreqs = get_fftfreqs (ws[0][0])[1:] / 1e6 # in MHz
+        ymax = np.max (np.max (ffts, axis=-1), axis=1)
+        ymin = np.min (np.min (ffts, axis=-1), axis=1)
+        for chan in range (4):
+            for dda in range (4):
+                which = 4 * chan + dda + 1
+                ax = fig.add_subplot (4, 4, which)
+                plot = ax.semilogy if log else ax.plot
+                plot (fftfreqs, ffts[chan][dda], '-', lw=.5)
+                ax.xaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=4))
+                ax.yaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=4))
+                if chan < 3:
+                    ax.set_xticklabels ([])
+                if dda > 0:
+                    ax.set_yticklabels ([])
+                ax.set_xlim (0, 1000)
+                the_ymin = ymin[chan] if log else 0
+                if self.menu.equally_action.get_active ():
+                    ax.set_ylim (the_ymin, 1.05 * ymax[chan])
+                else:
+                    ax.set_ylim (the_ymin, 1.05 * ffts[chan][dda].max ())
+                    ax.set_yticklabels ([])
+                ax.grid (color='.7', zorder=-10)
+                if dda == 0:
+                    ax.set_ylabel (self.channel_labels[chan])
+                if chan == 0:
+                    ax.set_title ('DDA {0}'.format (dda + 1))
+        fig.subplots_adjust (**self.subplot_args)
+
+    def _plot_event_hilbert (self, fig):
+        n = self._get_selected_event_number ()
+        ev = self.dsm.events[n]
+
+        fig.clf ()
+
+        ws = self._get_ws (ev)
+        hilberts = np.abs (scipy.signal.hilbert (ws))
+        y_extrema = np.max (np.max (hilberts.T[1:].T, axis=-1), axis=1)
+        t = np.arange (len (hilberts[0,0])) / aradecode.sample_rate  # see _get_ws
+        for chan in range (4):
+            for dda in range (4):
+                which = 4 * chan + dda + 1
+                ax = fig.add_subplot (4, 4, which)
+                ax.plot (t, hilberts[chan][dda], '-', lw=.5)
+                ax.xaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=4))
+                ax.yaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=4))
+                if chan < 3:
+                    ax.set_xticklabels ([])
+                if dda > 0:
+                    ax.set_yticklabels ([])
+                ax.set_xlim (0, t.max ())
+                if self.menu.equally_action.get_active ():
+                    ax.set_ylim (0, y_extrema[chan])
+                else:
+                    ax.set_yticklabels ([])
+                ax.grid (color='.7', zorder=-10)
+                if dda == 0:
+                    ax.set_ylabel (self.channel_labels[chan])
+                if chan == 0:
+                    ax.set_title ('DDA {0}'.format (dda + 1))
+        fig.subplots_adjust (**self.subplot_args)
+        
+
+    def _plot_event_xcorr (self, fig):
+        n = self._get_selected_event_number ()
+        ev = self.dsm.events[n]
+
+        fig.clf ()
+
+        ws = self._get_ws (ev)
+        n_chan, n_dda, n_samp = ws.shape
+        n_wf = n_chan * n_dda
+        xc = xcorr.cross_correlate (ws.reshape (n_wf, n_samp))
+        peak_lag, peak_value = xcorr.peaks (xc)
+        corr = xcorr.pair_matrix (np.abs (peak_value), n_wf, diagonal=1)
+        lag = xcorr.pair_matrix (peak_lag, n_wf, antisymmetric=True)
+        labels = ['{0} {1}'.format (
+            ''.join (word[0] for word in self.channel_labels[chan].split ()),
+            dda + 1)
+            for chan in range (n_chan) for dda in range (n_dda)]
+        max_lag = np.abs (lag).max () or 1
+        panels = [
+                (corr, 'peak |correlation|', dict (vmin=0, vmax=1)),
+                (lag, 'lag at peak (ns)',
+                    dict (vmin=-max_lag, vmax=max_lag, cmap='RdBu_r')),
+                ]
+        for i, (matrix, title, kwargs) in enumerate (panels):
+            ax = fig.add_subplot (1, 2, i + 1)
+            im = ax.imshow (matrix, interpolation='nearest', **kwargs)
+            ax.set_xticks (np.arange (n_wf))
+            ax.set_yticks (np.arange (n_wf))
+            ax.set_xticklabels (labels, rotation=90, fontsize='small')
+            ax.set_yticklabels (labels if i == 0 else [], fontsize='small')
+            for k in range (n_dda, n_wf, n_dda):
+                ax.axhline (k - .5, color='.7', lw=.5)
+                ax.axvline (k - .5, color='.7', lw=.5)
+            ax.set_title (title)
+            fig.colorbar (im, ax=ax, shrink=.6)
+        fig.subplots_adjust (top=.94, bottom=.12, left=.09, right=.98,
+                wspace=.1)
+
+    def _plot_event_overlay (self, fig, spectra):
+        events = [self.dsm.events[i]
+                for i in self._get_selected_event_numbers ()]
+
+        fig.clf ()
+        if not events:
+            return
+
+        # one (n_events, chan, dda, sample) array, cut to the shortest event
+        wss = [self._get_ws (ev) for ev in events]
+        n_samp = min (ws.shape[-1] for ws in wss)
+        ys = np.array ([ws[..., :n_samp] for ws in wss])
+        del wss
+        if spectra:
+            ys = np.abs (np.fft.rfft (ys))[..., 1:-1]
+            x = np.fft.rfftfreq (n_samp, 1. / aradecode.sample_rate)[1:-1]
+            x = 1e3 * x  # MHz
+        else:
+            x = np.arange (n_samp) / aradecode.sample_rate  # see _get_ws
+        if self.menu.bands_action.get_active () and len (ys) > 2:
+            lo, med, hi = np.percentile (ys, (self.overlay_percentiles[0],
+                50, self.overlay_percentiles[1]), axis=0)
+        else:
+            med = None
+        # pixel columns per axis; finer data cannot be seen anyway
+        args = self.subplot_args
+        width = fig.get_figwidth () * fig.dpi \
+                * (args['right'] - args['left']) / 4
+        x_dec, y_dec = minmax_decimate (x, ys, width)
+        if med is not None:
+            x_band, (lo, med, hi) = minmax_decimate (
+                    x, np.array ((lo, med, hi)), width)
+        alpha = min (1., max (.02, 10. / len (ys)))
+        if spectra:
+            ymax = ys.max (axis=(0, 2, 3))
+            ymin = np.array ([ys[:, chan][ys[:, chan] > 0].min (initial=1)
+                for chan in range (ys.shape[1])])
+        else:
+            ymax = np.abs (ys).max (axis=(0, 2, 3))
+        for chan in range (4):
+            for dda in range (4):
+                which = 4 * chan + dda + 1
+                ax = fig.add_subplot (4, 4, which)
+                if spectra:
+                    ax.set_yscale ('log')
+                # a new array per axis: LineCollection keeps, not copies, it
+                segments = np.stack (np.broadcast_arrays (
+                    x_dec, y_dec[:, chan, dda]), axis=-1)
+                ax.add_collection (LineCollection (
+                    segments, colors='C0', linewidths=.5, alpha=alpha))
+                if med is not None:
+                    ax.fill_between (x_band, lo[chan, dda], hi[chan, dda],
+                            color='C1', alpha=.4, lw=0, zorder=3)
+                    ax.plot (x_band, med[chan, dda], '-', color='k', lw=.5,
+                            zorder=4)
+                ax.xaxis.set_major_locator (
+                        mpl.ticker.MaxNLocator (nbins=4))
+                if chan < 3:
+                    ax.set_xticklabels ([])
+                if dda > 0:
+                    ax.set_yticklabels ([])
+                if spectra:
+                    ax.set_xlim (0, 1000)
+                    top = ymax[chan] if self.menu.equally_action.get_active () \
+                            else ys[:, chan, dda].max ()
+                    ax.set_ylim (ymin[chan], 1.05 * top)
+                else:
+                    ax.yaxis.set_major_locator (
+                            mpl.ticker.MaxNLocator (nbins=6, symmetric=True))
+                    ax.set_xlim (0, x.max ())
+                    extremum = ymax[chan] \
+                            if self.menu.equally_action.get_active () \
+                            else np.abs (ys[:, chan, dda]).max ()
+                    ax.set_ylim (-extremum, extremum)
+                if not self.menu.equally_action.get_active ():
+                    ax.set_yticklabels ([])
+                ax.grid (color='.7', zorder=-10)
+                if dda == 0:
+                    ax.set_ylabel (self.channel_labels[chan])
+                if chan == 0:
+                    ax.set_title ('DDA {0}'.format (dda + 1))
+        fig.suptitle ('{0} events'.format (len (ys)), fontsize='small')
+        fig.subplots_adjust (**self.subplot_args)
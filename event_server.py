@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# event_server.py
+
+
+from __future__ import print_function
+
+__doc__ = """Serve decoded, calibrated ARA events to local clients.
+
+One server process scans each requested .dat file once and decodes its events
+on demand (see aradecode.ara_event_list), keeps pedestal and timing tables
+loaded, and holds LRU caches of open files and calibrated waveforms, so that
+several displays or scripts looking at the same run share a single copy.
+ADDRESS is either a Unix socket path or HOST:PORT on localhost.
+
+Messages are a length-prefixed JSON header followed by length-prefixed
+arrays in NumPy .npy format.
+"""
+
+import collections
+import io
+import json
+import numpy as np
+import optparse
+import os
+import socket
+import socketserver
+import threading
+
+from struct import pack, unpack
+
+import aradecode
+
+
+def _parse_address (address):
+    if ':' in address:
+        host, port = address.rsplit (':', 1)
+        return socket.AF_INET, (host or 'localhost', int (port))
+    return socket.AF_UNIX, address
+
+def _recv_exactly (sock, n):
+    parts = []
+    while n:
+        part = sock.recv (min (n, 1 << 20))
+        if not part:
+            raise EOFError ('connection closed')
+        parts.append (part)
+        n -= len (part)
+    return b''.join (parts)
+
+def send_message (sock, header, arrays={}):
+    """Send a JSON-able header dict and a dict of named arrays."""
+    header = dict (header, arrays=sorted (arrays))
+    parts = [json.dumps (header).encode ()]
+    for name in sorted (arrays):
+        buf = io.BytesIO ()
+        np.save (buf, np.ascontiguousarray (arrays[name]), allow_pickle=False)
+        parts.append (buf.getvalue ())
+    sock.sendall (b''.join (pack ('<Q', len (p)) + p for p in parts))
+
+def recv_message (sock):
+    """Receive a message sent by send_message; return (header, arrays)."""
+    n, = unpack ('<Q', _recv_exactly (sock, 8))
+    header = json.loads (_recv_exactly (sock, n).decode ())
+    arrays = {}
+    for name in header.pop ('arrays'):
+        n, = unpack ('<Q', _recv_exactly (sock, 8))
+        arrays[name] = np.load (
+                io.BytesIO (_recv_exactly (sock, n)), allow_pickle=False)
+    return header, arrays
+
+
+class EventCache (object):
+
+    """Open runs, calibration tables and an LRU of calibrated waveforms."""
+
+    def __init__ (self, max_waveforms=1000, max_files=8):
+        self.max_waveforms = max_waveforms
+        self.max_files = max_files
+        self.lock = threading.Lock ()
+        self.file_locks = collections.defaultdict (threading.Lock)
+        self.files = collections.OrderedDict ()
+        self.cals = {}
+        self.waveforms = collections.OrderedDict ()
+        self.hits = self.misses = 0
+
+    def _cached_file (self, filename):
+        # call with self.lock held
+        if filename in self.files:
+            self.files.move_to_end (filename)
+            return self.files[filename]
+
+    def get_file (self, filename):
+        """Return (events, headers, event_id index) for filename."""
+        filename = os.path.realpath (filename)
+        with self.lock:
+            cached = self._cached_file (filename)
+            if cached:
+                return cached
+            file_lock = self.file_locks[filename]
+        with file_lock:
+            with self.lock:
+                cached = self._cached_file (filename)
+                if cached:
+                    return cached
+            events = aradecode.ara_event_list.from_file (filename)
+            headers = events.headers
+            by_id = dict ((int (event_id), i)
+                    for i, event_id in enumerate (headers['event_id']))
+            with self.lock:
+                self.files[filename] = events, headers, by_id
+                while len (self.files) > self.max_files:
+                    self.files.popitem (last=False)
+        return events, headers, by_id
+
+    def get_cal (self, cls, filename):
+        if not filename:
+            return None
+        key = cls, os.path.realpath (filename)
+        with self.lock:
+            if key not in self.cals:
+                self.cals[key] = cls.from_file (filename)
+            return self.cals[key]
+
+    def get_waveforms (self, filename, index, pedestals, timing, channels):
+        key = (os.path.realpath (filename), index,
+                pedestals and os.path.realpath (pedestals),
+                timing and os.path.realpath (timing), tuple (channels))
+        with self.lock:
+            if key in self.waveforms:
+                self.hits += 1
+                self.waveforms.move_to_end (key)
+                return self.waveforms[key]
+            self.misses += 1
+        events, headers, by_id = self.get_file (filename)
+        cal = self.get_cal (aradecode.ped_cal, pedestals) \
+                or aradecode.ped_cal ()
+        tcal = self.get_cal (aradecode.time_cal, timing)
+        ws = events[index].get_waveforms (cal, channels, tcal=tcal)
+        with self.lock:
+            self.waveforms[key] = ws
+            while len (self.waveforms) > self.max_waveforms:
+                self.waveforms.popitem (last=False)
+        return ws
+
+    def handle (self, request):
+        """Answer one request; return (header, arrays)."""
+        op = request.get ('op')
+        if op == 'stats':
+            with self.lock:
+                return dict (files=sorted (self.files),
+                        cached_waveforms=len (self.waveforms),
+                        hits=self.hits, misses=self.misses), {}
+        filename = request['file']
+        events, headers, by_id = self.get_file (filename)
+        if op == 'headers':
+            return dict (n_events=len (events)), dict (headers=headers)
+        if op == 'event':
+            if request.get ('event_id') is not None:
+                index = by_id[request['event_id']]
+            else:
+                index = request['index']
+            channels = request.get ('channels') or list (range (8))
+            ws = self.get_waveforms (filename, index,
+                    request.get ('pedestals'), request.get ('timing'),
+                    channels)
+            dtype = request.get ('dtype', 'float32')
+            return dict (index=index), dict (
+                    header=headers[index:index+1],
+                    waveforms=ws.astype (dtype))
+        raise ValueError ('unknown op {0!r}'.format (op))
+
+
+class _Handler (socketserver.BaseRequestHandler):
+
+    def handle (self):
+        while True:
+            try:
+                request, arrays = recv_message (self.request)
+            except (EOFError, ConnectionError):
+                return
+            try:
+                header, arrays = self.server.cache.handle (request)
+                header['ok'] = True
+            except Exception as e:
+                header, arrays = dict (ok=False, error=repr (e)), {}
+            send_message (self.request, header, arrays)
+
+
+class _UnixServer (socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer (socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server (address, cache):
+    """Return a threaded server for address (socket path or HOST:PORT)."""
+    family, addr = _parse_address (address)
+    if family == socket.AF_UNIX:
+        if os.path.exists (addr):
+            os.unlink (addr)
+        server = _UnixServer (addr, _Handler)
+    else:
+        server = _TCPServer (addr, _Handler)
+    server.cache = cache
+    return server
+
+
+class EventClient (object):
+
+    """Connection to an event server."""
+
+    def __init__ (self, address):
+        family, addr = _parse_address (address)
+        self.address = address
+        self.sock = socket.socket (family, socket.SOCK_STREAM)
+        self.sock.connect (addr)
+        self.lock = threading.Lock ()
+
+    def request (self, **request):
+        """Send a request; return (header, arrays) or raise RuntimeError."""
+        with self.lock:
+            send_message (self.sock, request)
+            header, arrays = recv_message (self.sock)
+        if not header.pop ('ok'):
+            raise RuntimeError (header['error'])
+        return header, arrays
+
+    def headers (self, filename):
+        """Return the store_header_dtype header table of filename."""
+        return self.request (op='headers',
+                file=os.path.abspath (filename))[1]['headers']
+
+    def waveforms (self, filename, index=None, event_id=None, pedestals=None,
+            timing=None, channels=None, dtype='float32'):
+        """Return calibrated (channel, dda, sample) waveforms of one event."""
+        header, arrays = self.request (op='event',
+                file=os.path.abspath (filename), index=index,
+                event_id=event_id,
+                pedestals=pedestals and os.path.abspath (pedestals),
+                timing=timing and os.path.abspath (timing),
+                channels=channels and [int (c) for c in channels],
+                dtype=dtype)
+        return arrays['waveforms']
+
+    def events (self, filename, headers=None):
+        """Return remote_event proxies for every event in filename."""
+        if headers is None:
+            headers = self.headers (filename)
+        return [remote_event (self, filename, i, h)
+                for i, h in enumerate (headers)]
+
+    def stats (self):
+        return self.request (op='stats')[0]
+
+    def close (self):
+        self.sock.close ()
+
+
+class remote_event (aradecode.atri_event):
+
+    """An atri_event whose waveforms are calibrated by an event server.
+
+    Calibration tables are passed to the server by filename, so cal (and
+    tcal) must have been loaded with from_file().
+    """
+
+    def __init__ (self, client, filename, index, header):
+        self._set_header_row (header)
+        self._client = client
+        self._filename = filename
+        self._index = index
+
+    def get_waveforms (self, cal, channels=range (8), tcal=None):
+        if cal.filename is None:
+            raise ValueError ('pedestals must be loaded from a file')
+        return self._client.waveforms (self._filename, index=self._index,
+                pedestals=cal.filename, timing=tcal and tcal.filename,
+                channels=channels, dtype='float64')
+
+    def get_waveform (self, dda, ch, cal):
+        return self.get_waveforms (cal, [ch])[0, dda]
+
+
+def main ():
+    usage = '%prog {[options]} [ADDRESS]'
+    parser = optparse.OptionParser (usage=usage, description=__doc__)
+    parser.add_option ('-c', '--cache', dest='cache',
+            default=1000, type=int, metavar='N',
+            help='keep calibrated waveforms of up to N events')
+    parser.add_option ('-f', '--files', dest='files',
+            default=8, type=int, metavar='N',
+            help='keep up to N data files open')
+    opts, args = parser.parse_args ()
+    if len (args) != 1:
+        parser.error ('must provide a socket path or HOST:PORT')
+
+    server = make_server (args[0], EventCache (opts.cache, opts.files))
+    print ('Serving events on {0} ...'.format (args[0]))
+    try:
+        server.serve_forever ()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close ()
+        family, addr = _parse_address (args[0])
+        if family == socket.AF_UNIX and os.path.exists (addr):
+            os.unlink (addr)
+
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# export_waveforms.py
+
+
+from __future__ import print_function
+
+__doc__ = """Export calibrated waveforms to chunked .npz or HDF5 files.
+
+Selected events from one or more .dat files are streamed, pedestal-subtracted
+(and optionally timing-calibrated and filtered) and written in chunks of N events, each
+holding a header table (aradecode.store_header_dtype) and a fixed-shape
+(event, channel, dda, sample) array, so memory use stays bounded no matter
+how much data goes through.
+
+With --format npz, chunk k goes to OUTFILE_BASE_{k:05d}.npz; with --format
+hdf5, everything goes to OUTFILE_BASE.h5 with datasets "headers" and
+"waveforms" (this needs h5py).
+"""
+
+import numpy as np
+import optparse
+import os
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+import aradecode
+import filters
+from select_events import Select
+
+
+class _NpzWriter (object):
+
+    def __init__ (self, base, compress):
+        self.base = base
+        self.save = np.savez_compressed if compress else np.savez
+        self.n_chunks = 0
+
+    def write (self, headers, waveforms):
+        outfile = '{0}_{1:05d}.npz'.format (self.base, self.n_chunks)
+        print ('* {0} ...'.format (outfile))
+        self.save (outfile, headers=headers, waveforms=waveforms)
+        self.n_chunks += 1
+
+    def close (self):
+        pass
+
+
+class _Hdf5Writer (object):
+
+    def __init__ (self, base, compress, chunk, shape, dtype):
+        outfile = base + '.h5'
+        print ('* {0} ...'.format (outfile))
+        self.f = h5py.File (outfile, 'w')
+        kwargs = dict (compression='gzip') if compress else {}
+        self.headers = self.f.create_dataset ('headers', (0,),
+                dtype=aradecode.store_header_dtype, maxshape=(None,),
+                chunks=(chunk,), **kwargs)
+        self.waveforms = self.f.create_dataset ('waveforms', (0,) + shape,
+                dtype=dtype, maxshape=(None,) + shape,
+                chunks=(min (chunk, 64),) + shape, **kwargs)
+
+    def write (self, headers, waveforms):
+        n0 = len (self.headers)
+        n1 = n0 + len (headers)
+        self.headers.resize ((n1,))
+        self.waveforms.resize (n1, axis=0)
+        self.headers[n0:n1] = headers
+        self.waveforms[n0:n1] = waveforms
+
+    def close (self):
+        self.f.close ()
+
+
+class Export (object):
+
+    def run (self, argv=None):
+        usage = '%prog {[options]} [outfile_base] [infile] {[infile]...}'
+        self.parser = parser = optparse.OptionParser (
+                usage=usage, description=__doc__)
+
+        parser.add_option ('-P', '--pedestals-file', dest='pedestals_file',
+                metavar='FILE', help='subtract pedestals from FILE')
+        parser.add_option ('--timing-file', dest='timing_file',
+                metavar='FILE',
+                help='resample using the timing calibration in FILE')
+        parser.add_option ('-f', '--format', dest='format',
+                default='npz', type='choice', choices=['npz', 'hdf5'],
+                help='output format: npz or hdf5')
+        parser.add_option ('-n', '--chunk', dest='chunk',
+                default=1000, type=int, metavar='N',
+                help='write N events at a time')
+        parser.add_option ('--dtype', dest='dtype',
+                default='float32', type='choice',
+                choices=['float32', 'float64', 'int16'],
+                help='sample storage type: float32, float64 or int16')
+        parser.add_option ('-c', '--channels', dest='channels',
+                default='0,1,2,3,4,5,6,7', metavar='CH[,CH...]',
+                help='channels to export')
+        parser.add_option ('--samples', dest='samples',
+                default=0, type=int, metavar='N',
+                help='pad or truncate waveforms to N samples '
+                '(default: length of the first event)')
+        parser.add_option ('-z', '--compress', dest='compress',
+                default=False, action='store_true',
+                help='compress the output')
+        parser.add_option ('-t', '--min-time', dest='min_time',
+                default=None, metavar='YYYY-MM-DD HH:MM:SS',
+                help='minimum time to export')
+        parser.add_option ('-T', '--max-time', dest='max_time',
+                default=None, metavar='YYYY-MM-DD HH:MM:SS',
+                help='maximum time to export')
+        parser.add_option ('-e', '--event-ids', dest='event_ids',
+                default='', metavar='ID[,ID...]',
+                help='only export these event ids')
+        filters.add_options (parser)
+
+        opts, args = self.opts, self.args = parser.parse_args (argv)
+
+        if len (args) < 2:
+            parser.error (
+                    'must provide output file base and at least one input file')
+        if not opts.pedestals_file:
+            parser.error ('must provide --pedestals-file')
+        if opts.format == 'hdf5' and h5py is None:
+            parser.error ('--format hdf5 needs h5py')
+        self.outfile_base = args[0]
+        self.infiles = args[1:]
+        for infile in self.infiles:
+            if not os.path.isfile (infile):
+                parser.error ('could not find "{0}"'.format (infile))
+
+        self.min_time = Select.parse_times (opts.min_time)
+        self.max_time = Select.parse_times (opts.max_time)
+        self.event_ids = set (
+                int (x) for x in opts.event_ids.split (',') if x)
+        self.channels = [int (x) for x in opts.channels.split (',')]
+        self.cal = aradecode.ped_cal.from_file (opts.pedestals_file)
+        if opts.timing_file:
+            self.tcal = aradecode.time_cal.from_file (opts.timing_file)
+        else:
+            self.tcal = None
+        try:
+            self.filters = filters.from_options (opts)
+        except ValueError as e:
+            parser.error (str (e))
+
+        self.handle_files ()
+
+    def selected (self, ev):
+        """Return whether ev passes the selection."""
+        if self.event_ids and ev.event_id not in self.event_ids:
+            return False
+        if self.min_time is not None or self.max_time is not None:
+            t = ev.get_unix_datetime ()
+            if self.min_time is not None and t < self.min_time:
+                return False
+            if self.max_time is not None and t > self.max_time:
+                return False
+        return True
+
+    def events (self):
+        for infile in self.infiles:
+            print ('- {0} ...'.format (infile))
+            stream = aradecode.ara_pipelined_stream (
+                    aradecode.open_ara_file (infile),
+                    types=(aradecode.atri_event_type,))
+            for ev in stream:
+                if isinstance (ev, aradecode.atri_event) \
+                        and self.selected (ev):
+                    yield ev
+
+    def handle_files (self):
+        opts = self.opts
+        dtype = np.dtype (opts.dtype)
+        chunk = opts.chunk
+        writer = None
+        n = N = 0
+        for ev in self.events ():
+            w = ev.get_waveforms (self.cal, self.channels, tcal=self.tcal)
+            if self.filters:
+                w = self.filters (w)
+            if writer is None:
+                n_samples = opts.samples or w.shape[-1]
+                shape = (len (self.channels), 4, n_samples)
+                headers = np.zeros (chunk, aradecode.store_header_dtype)
+                waveforms = np.zeros ((chunk,) + shape, dtype)
+                if opts.format == 'hdf5':
+                    writer = _Hdf5Writer (self.outfile_base, opts.compress,
+                            chunk, shape, dtype)
+                else:
+                    writer = _NpzWriter (self.outfile_base, opts.compress)
+            w = w[...,:n_samples]
+            if dtype.kind == 'i':
+                info = np.iinfo (dtype)
+                w = np.clip (np.round (w), info.min, info.max)
+            headers[n] = aradecode.header_row (ev)
+            waveforms[n,...,:w.shape[-1]] = w
+            waveforms[n,...,w.shape[-1]:] = 0
+            n += 1
+            N += 1
+            if n == chunk:
+                writer.write (headers, waveforms)
+                n = 0
+        if writer is not None:
+            if n:
+                writer.write (headers[:n], waveforms[:n])
+            writer.close ()
+        print ('{0} events exported.'.format (N))
+
+
+if __name__ == '__main__':
+    Export ().run ()
@@ -0,0 +1,167 @@
+# features.py
+
+"""Per-event, per-channel waveform features computed in batches.
+
+For every waveform the features are its peak |amplitude|, RMS, SNR (peak over
+the RMS of the quietest quarter of the trace), Hilbert envelope peak and the
+time of that peak, and the dominant frequency of its spectrum.  Waveforms of
+many events are processed at once with NumPy/SciPy, and results for a file
+can be cached next to it.
+
+"""
+
+import numpy as np
+import os
+import scipy.fft
+import scipy.signal
+
+import aradecode
+
+#: per-channel features, in table order
+names = ('peak', 'rms', 'snr', 'env_peak', 'env_time', 'freq')
+
+
+def table_dtype(n_wf):
+    """Return the feature table dtype for n_wf waveforms per event."""
+    return np.dtype([('event_id', '<i4')]
+                    + [(name, '<f4', (n_wf,)) for name in names])
+
+
+def compute(ws):
+    """Compute features of a batch of equal-length waveforms.
+
+    Parameters
+    ----------
+    ws : (..., n) array
+
+    Returns
+    -------
+    dict of (...) arrays, one per name in names
+    """
+    ws = np.asarray(ws, float)
+    n = ws.shape[-1]
+    out = {}
+    out['peak'] = np.abs(ws).max(axis=-1)
+    out['rms'] = np.sqrt(np.mean(ws**2, axis=-1))
+    quarters = ws[...,:n - n % 4].reshape(ws.shape[:-1] + (4, -1))
+    noise = np.sqrt(np.mean(quarters**2, axis=-1)).min(axis=-1)
+    out['snr'] = out['peak'] / np.where(noise > 0, noise, np.inf)
+    env = np.abs(scipy.signal.hilbert(ws, axis=-1))
+    k = np.argmax(env, axis=-1)
+    out['env_peak'] = np.take_along_axis(env, k[...,None], -1)[...,0]
+    out['env_time'] = k / aradecode.sample_rate
+    spectrum = np.abs(scipy.fft.rfft(ws, axis=-1))
+    spectrum[...,0] = 0
+    freqs = scipy.fft.rfftfreq(n, 1 / aradecode.sample_rate) * 1e3  # MHz
+    out['freq'] = freqs[np.argmax(spectrum, axis=-1)]
+    return out
+
+
+def compute_events(events, cal, channels=range(8), tcal=None,
+                   batch_size=256, n_points=None):
+    """Return the feature table of a sequence of events.
+
+    Waveforms are ordered as get_waveforms(cal, channels) flattened over
+    (channel, dda).  Events are processed in batches of equal length.
+
+    If n_points is given, the coarse peak envelopes of the events (see
+    envelopes()) are computed from the same calibrated waveforms, and
+    (table, envelopes) is returned.
+    """
+    channels = list(channels)
+    if not hasattr(events, '__len__'):
+        events = list(events)
+    table = np.zeros(len(events), table_dtype(4 * len(channels)))
+    if n_points:
+        envs = np.zeros((len(table), n_points), np.float32)
+    batches = {}
+    def flush(key):
+        idx, wss = batches.pop(key)
+        feats = compute(np.array(wss))
+        for name in names:
+            table[name][idx] = feats[name]
+    # a growing sequence (e.g. a followed file) is cut at its initial length
+    for i, ev in zip(range(len(table)), events):
+        table['event_id'][i] = ev.event_id
+        ws = ev.get_waveforms(cal, channels, tcal=tcal)
+        ws = ws.reshape(-1, ws.shape[-1])
+        if n_points:
+            envs[i] = _envelope(ws, n_points)
+        idx, wss = batches.setdefault(ws.shape, ([], []))
+        idx.append(i)
+        wss.append(ws)
+        if len(idx) == batch_size:
+            flush(ws.shape)
+    for key in list(batches):
+        flush(key)
+    return (table, envs) if n_points else table
+
+
+def envelopes(events, cal, channels=range(8), tcal=None, n_points=48):
+    """Return the coarse peak envelope of each event.
+
+    Element [i, k] is the largest |amplitude| over all channels and DDAs of
+    events[i] within the k-th of n_points equal time bins, which is enough
+    to draw the event as a sparkline.
+    """
+    channels = list(channels)
+    out = np.zeros((len(events), n_points), np.float32)
+    for i, ev in enumerate(events):
+        out[i] = _envelope(
+            ev.get_waveforms(cal, channels, tcal=tcal), n_points)
+    return out
+
+
+def _envelope(ws, n_points):
+    a = np.abs(ws.reshape(-1, ws.shape[-1])).max(axis=0)
+    edges = np.arange(n_points) * len(a) // n_points
+    return np.maximum.reduceat(a, edges)
+
+
+def cache_filename(filename):
+    return filename + '.features.npz'
+
+
+def _cache_key(filename, cal, channels):
+    st = os.stat(filename)
+    return [str(st.st_size), repr(st.st_mtime),
+            os.path.abspath(cal.filename) if cal.filename else '',
+            ','.join(map(str, channels))]
+
+
+def load_cached(filename, cal, channels=range(8)):
+    """Return the cached feature table of filename, or None if stale."""
+    try:
+        with np.load(cache_filename(filename), allow_pickle=False) as f:
+            key = f['key'].tolist()
+            table = f['table']
+    except (OSError, KeyError, ValueError):
+        return None
+    return table if key == _cache_key(filename, cal, channels) else None
+
+
+def save_cached(filename, cal, channels, table):
+    """Store table next to filename; return False if that is not possible."""
+    key = np.array(_cache_key(filename, cal, channels))
+    try:
+        with open(cache_filename(filename), 'wb') as f:
+            np.savez(f, key=key, table=table)
+    except OSError:
+        return False
+    return True
+
+
+def event_columns(table):
+    """Reduce per-channel features to one value per event.
+
+    Returns peak, env_peak and snr as maxima over channels, rms as the
+    median, and env_time and freq of the channel with the largest envelope.
+    """
+    loudest = np.argmax(table['env_peak'], axis=-1)[:,None]
+    return dict(
+        peak=table['peak'].max(axis=-1),
+        rms=np.median(table['rms'], axis=-1),
+        snr=table['snr'].max(axis=-1),
+        env_peak=table['env_peak'].max(axis=-1),
+        env_time=np.take_along_axis(table['env_time'], loudest, -1)[:,0],
+        freq=np.take_along_axis(table['freq'], loudest, -1)[:,0])
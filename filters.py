@@ -0,0 +1,119 @@
+# filters.py
+
+"""Band-pass and notch filtering of waveforms in the frequency domain.
+
+A filter_bank is a band-pass (Butterworth magnitude response, zero phase)
+followed by any number of notches, e.g. for CW lines.  Its combined response
+is computed once per (waveform length, sample rate) and cached; filtering a
+whole (..., n) array, such as one event's (channel, dda, sample) waveforms,
+then takes one rfft, one multiply and one irfft.
+
+"""
+
+import functools
+import numpy as np
+import scipy.fft
+
+from aradecode import sample_rate
+
+
+@functools.lru_cache(maxsize=64)
+def response(n, rate, band=None, notches=(), order=4):
+    """Return the rfft-bin magnitude response of a filter_bank.
+
+    Parameters
+    ----------
+    n : int
+        waveform length in samples
+    rate : float
+        sample rate in samples per ns
+    band : (low, high) in MHz
+        pass band; either edge may be None
+    notches : tuple of (center, width) in MHz
+        stop bands, attenuated 3 dB at center +/- width / 2
+    order : int
+        Butterworth order of every edge
+    """
+    f = 1e3 * np.fft.rfftfreq(n, 1. / rate)  # MHz
+    h = np.ones_like(f)
+    low, high = band or (None, None)
+    with np.errstate(divide='ignore'):
+        if low:
+            h /= np.sqrt(1 + (low / f) ** (2 * order))
+        if high:
+            h /= np.sqrt(1 + (f / high) ** (2 * order))
+        for center, width in notches:
+            h /= np.sqrt(1 + (.5 * width / np.abs(f - center)) ** (2 * order))
+    h.flags.writeable = False
+    return h
+
+
+class filter_bank(object):
+    def __init__(self, band=None, notches=(), order=4):
+        """
+        Parameters
+        ----------
+        band : (low, high) in MHz
+            pass band; either edge may be None
+        notches : sequence of (center, width) in MHz
+            stop bands
+        order : int
+            Butterworth order of every edge
+        """
+        self.band = tuple(band) if band else None
+        self.notches = tuple(tuple(notch) for notch in notches)
+        self.order = order
+
+    def __bool__(self):
+        return bool(self.band or self.notches)
+
+    def response(self, n, rate=sample_rate):
+        return response(n, rate, self.band, self.notches, self.order)
+
+    def __call__(self, ws, rate=sample_rate, workers=None):
+        """Return ws (..., n) filtered along its last axis."""
+        ws = np.asarray(ws)
+        n = ws.shape[-1]
+        spectra = scipy.fft.rfft(ws, axis=-1, workers=workers)
+        spectra *= self.response(n, rate)
+        return scipy.fft.irfft(spectra, n, axis=-1, workers=workers)
+
+    def __str__(self):
+        parts = []
+        if self.band:
+            parts.append('{0}-{1} MHz'.format(*self.band))
+        for center, width in self.notches:
+            parts.append('notch {0}+/-{1} MHz'.format(center, .5 * width))
+        return ', '.join(parts) or 'no filter'
+
+
+def _parse_pair(text):
+    return tuple(float(x) if x else None for x in text.split(':'))
+
+
+def add_options(parser):
+    """Add --band, --notch and --filter-order to an optparse parser."""
+    parser.add_option('--band', dest='band', metavar='LOW:HIGH',
+            help='band-pass filter waveforms to LOW-HIGH MHz '
+            '(either may be left out)')
+    parser.add_option('--notch', dest='notches', action='append',
+            default=[], metavar='CENTER:WIDTH',
+            help='notch out CENTER +/- WIDTH/2 MHz; may be repeated')
+    parser.add_option('--filter-order', dest='filter_order',
+            default=4, type=int, metavar='N',
+            help='Butterworth order of filter edges')
+
+
+def from_options(opts):
+    """Return the filter_bank given by add_options() options.
+
+    Raises ValueError for a malformed --band or --notch.
+    """
+    band = _parse_pair(opts.band) if opts.band else None
+    notches = [_parse_pair(notch) for notch in opts.notches]
+    if band is not None and len(band) != 2:
+        raise ValueError('--band must be LOW:HIGH')
+    for notch in notches:
+        if len(notch) != 2 or None in notch:
+            raise ValueError('--notch must be CENTER:WIDTH')
+    return filter_bank(band, notches, opts.filter_order)
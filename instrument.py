@@ -0,0 +1,185 @@
+# instrument.py
+
+"""Opt-in per-stage timing and memory instrumentation.
+
+Nothing here costs anything until enable() is called: hooks are installed by
+replacing functions and methods with timing wrappers, and disable() puts the
+originals back.  Stage times are inclusive, so nested stages (for example
+get_waveform inside _get_ws) are also counted in their callers.
+
+"""
+
+import functools
+import json
+import resource
+import threading
+import time
+import tracemalloc
+
+
+class Stage(object):
+    """Counters and timers for one instrumented stage."""
+
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+        self.bytes = 0
+
+    def as_dict(self):
+        return dict(calls=self.calls, seconds=self.seconds,
+                    max_seconds=self.max_seconds, bytes=self.bytes)
+
+
+stats = {}
+_lock = threading.Lock()
+_installed = []
+_memory = False
+_writer = None
+
+
+def _record(stage, dt, nbytes):
+    with _lock:
+        s = stats.get(stage)
+        if s is None:
+            s = stats[stage] = Stage()
+        s.calls += 1
+        s.seconds += dt
+        s.max_seconds = max(s.max_seconds, dt)
+        s.bytes += nbytes
+
+
+def _timed(func, stage):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        m0 = tracemalloc.get_traced_memory()[0] if _memory else 0
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            dt = time.perf_counter() - t0
+            dm = tracemalloc.get_traced_memory()[0] - m0 if _memory else 0
+            _record(stage, dt, dm)
+    return wrapper
+
+
+def wrap(owner, name, stage=None):
+    """Account calls to owner.name (a module or class attribute) as stage.
+
+    Parameters
+    ----------
+    owner : module or class
+    name : str
+        function, method, classmethod or staticmethod name
+    stage : str
+        stage name; defaults to name
+    """
+    stage = stage or name
+    inherited = name not in vars(owner)
+    raw = getattr(owner, name) if inherited else vars(owner)[name]
+    if isinstance(raw, (classmethod, staticmethod)):
+        wrapped = type(raw)(_timed(raw.__func__, stage))
+    else:
+        wrapped = _timed(raw, stage)
+    setattr(owner, name, wrapped)
+    _installed.append((owner, name, None if inherited else raw))
+
+
+def enable(memory=False):
+    """Install the decoding and calibration hooks.
+
+    Parameters
+    ----------
+    memory : bool
+        also track net Python allocations per stage (slow)
+    """
+    global _memory
+    import aradecode
+    if memory:
+        tracemalloc.start()
+        _memory = True
+    wrap(aradecode, 'decode_ara_blob')
+    wrap(aradecode, 'parse_ara_blob')
+    wrap(aradecode.atri_event, '__init__', 'atri_event')
+    wrap(aradecode.atri_event, 'from_buffer', 'atri_event')
+    wrap(aradecode.atri_event, 'get_waveform')
+    wrap(aradecode.atri_event, 'get_waveforms')
+    wrap(aradecode.stored_event, 'get_waveform')
+    wrap(aradecode.ped_cal, '__init__', 'ped_cal')
+
+
+def disable():
+    """Remove every installed hook and stop any stats writer."""
+    global _memory
+    while _installed:
+        owner, name, raw = _installed.pop()
+        if raw is None:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, raw)
+    if _memory:
+        tracemalloc.stop()
+        _memory = False
+    stop_writer()
+
+
+def enabled():
+    return bool(_installed)
+
+
+def snapshot():
+    """Return the current stats as a JSON-serializable dict."""
+    with _lock:
+        stages = dict((k, v.as_dict()) for k, v in stats.items())
+    return dict(time=time.time(), stages=stages,
+                max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def report():
+    """Return the current stats as a text table."""
+    snap = snapshot()
+    lines = ['{0:24s} {1:>9s} {2:>10s} {3:>10s} {4:>10s} {5:>10s}'.format(
+        'stage', 'calls', 'total s', 'mean ms', 'max ms', 'alloc MB')]
+    stages = snap['stages']
+    for stage in sorted(stages, key=lambda k: -stages[k]['seconds']):
+        s = stages[stage]
+        lines.append(
+            '{0:24s} {1:9d} {2:10.3f} {3:10.3f} {4:10.3f} {5:10.2f}'.format(
+                stage, s['calls'], s['seconds'],
+                1e3 * s['seconds'] / max(s['calls'], 1),
+                1e3 * s['max_seconds'], s['bytes'] / 2.**20))
+    lines.append('max RSS: {0:.1f} MB'.format(snap['max_rss_kb'] / 1024.))
+    return '\n'.join(lines)
+
+
+def write(filename):
+    """Write the current stats to filename as JSON."""
+    with open(filename, 'w') as f:
+        json.dump(snapshot(), f, indent=2, sort_keys=True)
+
+
+def start_writer(filename, interval=10.):
+    """Rewrite the stats file every interval seconds in the background."""
+    global _writer
+    stop_writer()
+    stop = threading.Event()
+    def loop():
+        while not stop.wait(interval):
+            write(filename)
+    thread = threading.Thread(target=loop)
+    thread.daemon = True
+    thread.start()
+    _writer = (filename, stop, thread)
+
+
+def stop_writer():
+    """Stop the stats writer, writing the file one last time."""
+    global _writer
+    if _writer is not None:
+        filename, stop, thread = _writer
+        stop.set()
+        thread.join()
+        write(filename)
+        _writer = None
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# make_pedestals.py
+
+
+from __future__ import print_function
+
+__doc__ = """Build a pedestal table directly from raw .dat files.
+
+Every sample of every readout block is accumulated per (dda, irs_blk, ch,
+sample) in a single streaming pass, so forced-trigger runs can be turned into
+pedestals without the C++ toolchain.  The result can be written in the text
+format read by aradecode.ped_cal and/or as a binary .npy table.
+"""
+
+import multiprocessing
+import numpy as np
+import optparse
+import os
+
+import aradecode
+
+
+_n_cells = 4 * 512 * 8
+
+
+def accumulate (filename, chunk=256):
+    """Return per-cell sample sums and per-(dda, irs_blk, ch) block counts.
+
+    Returns
+    -------
+    sums : (4*512*8*64,) float64 array
+    counts : (4*512*8,) int64 array
+    """
+    sums = np.zeros (64 * _n_cells)
+    counts = np.zeros (_n_cells, np.int64)
+    cells, values = [], []
+    def flush ():
+        if not cells:
+            return
+        c = np.concatenate (cells)
+        v = np.concatenate (values)
+        counts[:] += np.bincount (c, minlength=_n_cells)
+        idx = (64 * c[:,None] + np.arange (64)).ravel ()
+        sums[:] += np.bincount (idx, weights=v.ravel (),
+                minlength=64 * _n_cells)
+        del cells[:], values[:]
+    stream = aradecode.ara_pipelined_stream (aradecode.open_ara_file (filename),
+            types=(aradecode.atri_event_type,))
+    for n, ev in enumerate (stream):
+        if not isinstance (ev, aradecode.atri_event):
+            continue
+        irs_blk, nch, samples = ev.get_block_samples ()
+        dda = np.arange (ev.nblk) % 4
+        present = np.arange (8) < nch[:,None]
+        block_cells = (dda[:,None] * 512 + irs_blk[:,None]) * 8 \
+                + np.arange (8)
+        cells.append (block_cells[present])
+        values.append (samples[present])
+        if n % chunk == chunk - 1:
+            flush ()
+    flush ()
+    return sums, counts
+
+def build (filenames, jobs=1):
+    """Accumulate all files (in jobs processes) and return a ped_cal."""
+    sums = np.zeros (64 * _n_cells)
+    counts = np.zeros (_n_cells, np.int64)
+    if jobs > 1 and len (filenames) > 1:
+        pool = multiprocessing.Pool (jobs)
+        results = pool.imap_unordered (accumulate, filenames)
+    else:
+        pool = None
+        results = map (accumulate, filenames)
+    for s, c in results:
+        sums += s
+        counts += c
+    if pool is not None:
+        pool.close ()
+        pool.join ()
+    cal = aradecode.ped_cal ()
+    sums = sums.reshape (4, 512, 8, 64)
+    counts = counts.reshape (4, 512, 8, 1)
+    np.divide (sums, counts, out=cal.ped, where=counts > 0)
+    return cal, counts[...,0]
+
+
+def main ():
+    usage = '%prog {[options]} [pedestals file] [infile] {[infile]...}'
+    parser = optparse.OptionParser (usage=usage, description=__doc__)
+    parser.add_option ('-b', '--binary', dest='binary',
+            default='', metavar='FILE',
+            help='also write the table to FILE in binary .npy format')
+    parser.add_option ('-j', '--jobs', dest='jobs',
+            default=1, type=int, metavar='N',
+            help='read up to N files in parallel')
+
+    opts, args = parser.parse_args ()
+    if len (args) < 2:
+        parser.error (
+                'must provide pedestals file and at least one input file')
+    outfile = args[0]
+    infiles = args[1:]
+    for infile in infiles:
+        if not os.path.isfile (infile):
+            parser.error ('could not find "{0}"'.format (infile))
+    if opts.binary and not opts.binary.endswith ('.npy'):
+        parser.error ('--binary file name must end in .npy')
+
+    print ('Reading {0} files ...'.format (len (infiles)))
+    cal, counts = build (infiles, jobs=opts.jobs)
+    n_missing = (counts == 0).sum ()
+    if n_missing:
+        print ('{0} of {1} (dda, block, channel) cells had no samples.'.format (
+            n_missing, counts.size))
+    cal.write (outfile)
+    print ('Wrote pedestals to "{0}".'.format (outfile))
+    if opts.binary:
+        cal.write (opts.binary)
+        print ('Wrote pedestals to "{0}".'.format (opts.binary))
+
+
+if __name__ == '__main__':
+    main ()
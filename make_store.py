@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# make_store.py
+
+
+from __future__ import print_function
+
+__doc__ = """Convert .dat files into a memory-mapped columnar event store.
+
+The store can be read back with aradecode.ara_store, which exposes the usual
+atri_event interface (including get_waveform) without any gzip or struct
+decoding.
+"""
+
+import optparse
+import os
+
+import aradecode
+
+
+def main ():
+    usage = '%prog {[options]} [store_dir] [infile] {[infile]...}'
+    parser = optparse.OptionParser (usage=usage, description=__doc__)
+    opts, args = parser.parse_args ()
+
+    if len (args) < 2:
+        parser.error ('must provide store directory and at least one input file')
+
+    store_dir = args[0]
+    infiles = args[1:]
+    for infile in infiles:
+        if not os.path.isfile (infile):
+            parser.error ('could not find "{0}"'.format (infile))
+
+    print ('Writing {0} ...'.format (store_dir))
+    n = aradecode.write_store (infiles, store_dir)
+    print ('{0} events written.'.format (n))
+
+
+if __name__ == '__main__':
+    main ()
@@ -10,8 +10,8 @@ This is a relatively straightforward Python-based alternative to AraDisplay.
 It is not (yet?) a feature-complete port.
 """
 
+import collections
 import datetime
-import gzip
 import matplotlib as mpl
 from matplotlib.backends.backend_gtk3agg import FigureCanvasGTK3Agg as FigureCanvas
 mpl.use('GTK3Agg')
@@ -20,7 +20,6 @@ import numpy as np
 import optparse
 import os
 import re
-import scipy.signal
 import shutil
 import sys
 
@@ -33,30 +32,256 @@ from gi import pygtkcompat
 pygtkcompat.enable()
 pygtkcompat.enable_gtk(version='3.0')
 
-from gi.repository import Gtk
+from gi.repository import Gdk, GdkPixbuf, GLib, GObject, Gtk
 
 import aradecode
+import event_plots
+import event_server
+import features
+import filters
+import instrument
+import threading
 from vars_class import Vars
 
 
 class DataSetModel (Gtk.GenericTreeModel):
 
-    """DataSetModel (dataset) -> new Gtk.TreeModel for an ARA dataset."""
+    """DataSetModel (dataset) -> new Gtk.TreeModel for an ARA dataset.
+
+    Cell values come from NumPy columns computed once per event; strings
+    are only formatted for rows GTK actually asks for, and then cached.
+    Rows are shown in the order given by self.order (indices into
+    self.events), which sort_by() rearranges and set_filter() restricts.
+    Columns come from a header-only scan; self.events decodes an event only
+    when it is used (see aradecode.ara_event_list).
+    Feature columns stay empty until set_features() provides them.
+
+    Each event also has a coarse peak envelope, filled in by
+    set_sparklines(); sparkline_pixbuf() draws it into a small cached
+    pixbuf, or asks for it to be computed next.  clear_results() forgets
+    features and envelopes, e.g. after a calibration change.
+    """
+
+    #: (title, column name) for each TreeModel column
+    columns = [
+            ('unix time', 'time'),
+            ('event id', 'event_id'),
+            ('nblk', 'nblk'),
+            ('trigger', 'trigger'),
+            ('peak', 'peak'),
+            ('SNR', 'snr'),
+            ('RMS', 'rms'),
+            ('env peak', 'env_peak'),
+            ('env t', 'env_time'),
+            ('freq', 'freq'),
+            ]
+
+    _filter_re = re.compile (
+            r'^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*([-+.\w]+)\s*$')
+    _filter_ops = {
+            '<': np.less, '<=': np.less_equal, '==': np.equal,
+            '!=': np.not_equal, '>': np.greater, '>=': np.greater_equal}
+
+    #: sparkline pixbuf size (width, height) and envelope points
+    sparkline_size = (80, 16)
+    sparkline_points = 48
+    sparkline_color = (31, 119, 180)
+    #: at most this many sparkline pixbufs are kept
+    sparkline_cache_size = 4096
 
-    def __init__ (self, filename):
+    def __init__ (self, filename, follow=False, client=None):
         Gtk.GenericTreeModel.__init__ (self)
-        self.astr = aradecode.ara_stream (gzip.GzipFile (filename))
-        self.events = list (self.astr)
+        self.filename = filename
+        self.data = dict ((name, np.zeros (0)) for title, name in self.columns)
+        self.order = np.zeros (0, int)
+        self.filter = None
+        self.filter_text = ''
+        self.strings = {}
+        self.sort_column = None
+        self.sort_descending = False
+        self.sparklines = np.zeros ((0, self.sparkline_points), np.float32)
+        self.sparkline_pixbufs = collections.OrderedDict ()
+        # events drawn without a sparkline yet, most recent last
+        self.sparkline_wanted = collections.deque (maxlen=1024)
+        # bumped by clear_results(); older background results are dropped
+        self.generation = 0
+        self.station_id = None
+        if client is not None:
+            self.astr = None
+            headers = client.headers (filename)
+            self.events = client.events (filename, headers=headers)
+            self._append_headers (headers)
+        elif follow:
+            self.astr = aradecode.ara_follow_stream (filename)
+            self.events = aradecode.ara_event_list ()
+            self.poll ()
+        else:
+            self.astr = None
+            self.events = aradecode.ara_event_list.from_file (filename)
+            self._append_headers (self.events.headers)
+
+    def _append_headers (self, headers):
+        """Extend the columns (and the row order) by a header table."""
+        if self.station_id is None and len (headers):
+            self.station_id = int (headers['station_id'][0])
+        new = dict (
+                time=headers['unix'] + 1e-6 * headers['unix_us'],
+                event_id=headers['event_id'],
+                nblk=headers['nblk'],
+                trigger=headers['trigger_info'][:,0])
+        for name in features.names:
+            new[name] = np.full (len (headers), np.nan)
+        n0 = len (self.data['event_id'])
+        for name in new:
+            self.data[name] = np.concatenate ([self.data[name], new[name]])
+        self.order = np.concatenate (
+                [self.order, np.arange (n0, n0 + len (headers))])
+        if self.filter is not None:
+            self.filter = np.concatenate (
+                    [self.filter, np.ones (len (headers), bool)])
+        self.sparklines = np.concatenate ([self.sparklines, np.full (
+            (len (headers), self.sparkline_points), np.nan, np.float32)])
+
+    def poll (self):
+        """Append events written since the last poll; return how many.
+
+        New rows are announced if they simply go at the end; with a filter
+        or sort order the rows are rearranged instead, and views need to
+        be given the model again.
+        """
+        n = self.events.append_bytes (self.astr.read ())
+        if not n:
+            return n
+        self._append_headers (self.events.headers[-n:])
+        if self.filter is not None or self.sort_column is not None:
+            self.set_filter (self.filter_text)
+            return n
+        for row in range (len (self.order) - n, len (self.order)):
+            path = (row,)
+            self.row_inserted (path, self.get_iter (path))
+        return n
+
+    def set_features (self, indices, columns):
+        """Fill feature columns of events indices from per-event arrays."""
+        for name, values in columns.items ():
+            self.data[name][indices] = values
+        names = [name for title, name in self.columns]
+        indices = set (indices)
+        for key in list (self.strings):
+            if key[0] in indices and names[key[1]] in columns:
+                del self.strings[key]
+
+    def set_sparklines (self, indices, values):
+        """Store the envelopes of events indices."""
+        self.sparklines[indices] = values
+        for i in indices:
+            self.sparkline_pixbufs.pop (i, None)
+
+    def clear_results (self):
+        """Forget all features and envelopes."""
+        names = [name for title, name in self.columns]
+        for name in features.names:
+            self.data[name][:] = np.nan
+        for key in list (self.strings):
+            if names[key[1]] in features.names:
+                del self.strings[key]
+        self.sparklines[:] = np.nan
+        self.sparkline_pixbufs.clear ()
+        self.sparkline_wanted.clear ()
+        self.generation += 1
+
+    def sparkline_pixbuf (self, index):
+        """Return the sparkline of event index, or None if it is not known
+        yet; in that case it is queued in sparkline_wanted."""
+        pixbufs = self.sparkline_pixbufs
+        if index in pixbufs:
+            pixbufs.move_to_end (index)
+            return pixbufs[index]
+        values = self.sparklines[index]
+        if np.isnan (values[0]):
+            self.sparkline_wanted.append (index)
+            return None
+        width, height = self.sparkline_size
+        rgba = render_sparkline (values, width, height, self.sparkline_color)
+        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes (
+                GLib.Bytes.new (rgba.tobytes ()), GdkPixbuf.Colorspace.RGB,
+                True, 8, width, height, 4 * width)
+        pixbufs[index] = pixbuf
+        if len (pixbufs) > self.sparkline_cache_size:
+            pixbufs.popitem (last=False)
+        return pixbuf
+
+    def set_filter (self, text):
+        """Show only events matching text, e.g. "snr > 6, nblk == 32".
+
+        Clauses are ANDed; an empty text shows every event.  Raises
+        ValueError for clauses that cannot be parsed.
+        """
+        mask = np.ones (len (self.data['event_id']), bool)
+        clauses = [c for c in re.split (r',|\band\b', text) if c.strip ()]
+        for clause in clauses:
+            m = self._filter_re.match (clause)
+            if not m or m.group (1) not in self.data:
+                raise ValueError ('cannot parse "{0}"'.format (clause.strip ()))
+            name, op, value = m.groups ()
+            mask &= self._filter_ops[op] (self.data[name], float (value))
+        self.filter = mask if clauses else None
+        self.filter_text = text
+        order = np.arange (len (mask))
+        if self.sort_column is not None:
+            order = np.argsort (self.data[self.sort_column], kind='stable')
+            if self.sort_descending:
+                order = order[::-1]
+        self.order = order[mask[order]]
+
+    def format_value (self, name, value):
+        if np.isnan (value):
+            return ''
+        if name == 'time':
+            return str (datetime.datetime.utcfromtimestamp (value))
+        if name == 'trigger':
+            return '0x{0:x}'.format (int (value))
+        if name in features.names:
+            return '{0:.4g}'.format (value)
+        return str (int (value))
+
+    def row_of (self, index):
+        """Return the displayed row of event index, or None if hidden."""
+        rows = np.flatnonzero (self.order == index)
+        return int (rows[0]) if len (rows) else None
+
+    def find_event_id (self, event_id):
+        """Return the index of the event with event_id, or None."""
+        event_ids = self.data['event_id']
+        if not hasattr (self, '_by_event_id') \
+                or len (self._by_event_id) != len (event_ids):
+            self._by_event_id = np.argsort (event_ids, kind='stable')
+        k = np.searchsorted (event_ids[self._by_event_id], event_id)
+        if k < len (event_ids) and event_ids[self._by_event_id[k]] == event_id:
+            return int (self._by_event_id[k])
+        return None
+
+    def sort_by (self, name, descending=False):
+        """Reorder the rows by column name."""
+        values = self.data[name][self.order]
+        idx = np.argsort (values, kind='stable')
+        if descending:
+            idx = idx[::-1]
+        self.order = self.order[idx]
+        self.sort_column = name
+        self.sort_descending = descending
+        if len (idx):
+            self.rows_reordered (Gtk.TreePath.new (), None, idx.tolist ())
 
     # Section: Implementation of Gtk.GenericTreeModel
     def on_get_flags(self):
         return Gtk.TREE_MODEL_LIST_ONLY
 
     def on_get_n_columns(self):
-        return 2
+        return len (self.columns)
 
     def on_get_column_type(self, index):
-        if index in (0, 1):
+        if 0 <= index < len (self.columns):
             return str
         else:
             raise IndexError
@@ -68,23 +293,25 @@ class DataSetModel (Gtk.GenericTreeModel):
         return (rowref,)
 
     def on_get_value(self, row, col):
-        if 0 <= row < len (self.events):
-            ev = self.events[row]
-            if col == 0:
-                return str (ev.get_unix_datetime ())
-            if col == 1:
-                return str (ev.event_id)
+        if 0 <= row < len (self.order):
+            i = self.order[row]
+            key = i, col
+            if key not in self.strings:
+                name = self.columns[col][1]
+                self.strings[key] = self.format_value (
+                        name, self.data[name][i])
+            return self.strings[key]
         else:
             raise IndexError
 
     def on_iter_next(self, rowref):
-        if rowref == len (self.events) - 1:
+        if rowref == len (self.order) - 1:
             return None
         else:
             return rowref + 1
 
     def on_iter_children(self, parent):
-        if rowref:
+        if parent:
             return None
         return 0
 
@@ -95,12 +322,12 @@ class DataSetModel (Gtk.GenericTreeModel):
         if rowref:
             return 0
         else:
-            return len (self.events)
+            return len (self.order)
 
     def on_iter_nth_child(self, parent, n):
         if parent:
             return None
-        elif n < len (self.events):
+        elif n < len (self.order):
             return n
         else:
             return None
@@ -108,6 +335,58 @@ class DataSetModel (Gtk.GenericTreeModel):
     def on_iter_parent(self, child):
         return None
 
+
+class SparklineRenderer (Gtk.CellRenderer):
+
+    """Cell renderer drawing the sparkline of the event in self.event.
+
+    Rendering only blits a pixbuf from the DataSetModel cache (drawing one
+    if the envelope is known); envelopes themselves are computed elsewhere,
+    so scrolling never waits for them.
+    """
+
+    event = GObject.Property (type=int, default=-1)
+
+    def __init__ (self, dsm):
+        Gtk.CellRenderer.__init__ (self)
+        self.dsm = dsm
+
+    def do_get_size (self, widget, cell_area):
+        width, height = self.dsm.sparkline_size
+        return (0, 0, width + 2 * self.props.xpad,
+                height + 2 * self.props.ypad)
+
+    def do_render (self, cr, widget, background_area, cell_area, flags):
+        if self.event < 0:
+            return
+        pixbuf = self.dsm.sparkline_pixbuf (self.event)
+        if pixbuf is None:
+            return
+        width, height = self.dsm.sparkline_size
+        Gdk.cairo_set_source_pixbuf (cr, pixbuf,
+                cell_area.x + self.props.xpad,
+                cell_area.y + (cell_area.height - height) // 2)
+        cr.paint ()
+
+
+def render_sparkline (values, width, height, color, scale=4.):
+    """Return an RGBA (height, width, 4) uint8 image of values as a filled
+    area, from their median (the noise level) at the bottom to scale times
+    that at the top, so that impulses stand out."""
+    x = np.linspace (0, len (values) - 1, width)
+    v = np.interp (x, np.arange (len (values)), values)
+    noise = np.median (v)
+    if noise > 0:
+        v = np.clip ((v / noise - 1) / (scale - 1), 0, 1)
+    else:
+        v = np.zeros_like (v)
+    tops = np.round ((1 - v) * (height - 1))
+    filled = np.arange (height)[:,None] >= tops
+    rgba = np.zeros ((height, width, 4), np.uint8)
+    rgba[filled] = tuple (color) + (255,)
+    return rgba
+
+
 usage = r"""%prog {[options]} {[data file]} 
 
 This is a relatively straightforward Python-based alternative to AraDisplay.
@@ -124,19 +403,18 @@ data file matches /run(\d+)/.
 
 """
 
-class Window (object):
+class Window (event_plots.EventPlots):
 
     """PyAraDisplay window."""
 
-    channels = {}
-    channels[100] = [0, 1, 2, 3]
-    channels[2] = [3, 1, 2, 0]
-    channels[3] = [2, 0, 3, 1]
-    channels[4] = [3, 1, 2, 0]
-    channel_labels = ['Top Hpol', 'Top Vpol', 'Bottom Hpol', 'Bottom Vpol']
+    #: pass band (MHz) of the View > Filter toggle unless --band/--notch given
+    default_band = (150, 850)
 
-    subplot_args = dict (top=.94, bottom=.05, left=.09, right=.98,
-                hspace=0.02, wspace=0.02)
+    #: events per background feature and sparkline batch
+    analysis_batch = 32
+
+    event_list_widths = dict (time=170, event_id=70, nblk=45, trigger=60,
+            peak=60, snr=50, rms=50, env_peak=60, env_time=50, freq=50)
 
     def __init__ (self, commandline=''):
         
@@ -156,21 +434,73 @@ class Window (object):
         parser.add_option ('-P', '--pedestals-file', dest='pedestals_file',
                 metavar='FILE', help='load pedestals from FILE')
 
+        parser.add_option ('-t', '--timing-file', dest='timing_file',
+                metavar='FILE', help='load sample timing calibration '
+                'from FILE')
+
+        filters.add_options (parser)
+
         parser.add_option ('--plot-dir', dest='plot_dir',
                 metavar='DIR', help='by default put plots in DIR')
 
+        parser.add_option ('-F', '--follow', dest='follow',
+                default=False, action='store_true',
+                help='keep watching the data file for new events')
+
+        parser.add_option ('--follow-interval', dest='follow_interval',
+                default=1., type=float, metavar='SEC',
+                help='check for new events every SEC seconds')
+
+        parser.add_option ('-S', '--server', dest='server',
+                metavar='ADDRESS', help='get decoded events from the '
+                'event_server.py at ADDRESS (socket path or HOST:PORT)')
+
+        parser.add_option ('--profile', dest='profile',
+                default=False, action='store_true',
+                help='time decoding, calibration and plotting stages '
+                'and print a summary on exit')
+
+        parser.add_option ('--profile-memory', dest='profile_memory',
+                default=False, action='store_true',
+                help='with --profile, also track allocations per stage')
+
+        parser.add_option ('--profile-file', dest='profile_file',
+                metavar='FILE', help='with --profile, periodically write '
+                'stage statistics to FILE as JSON')
+
+        parser.add_option ('--profile-interval', dest='profile_interval',
+                default=10., type=float, metavar='SEC',
+                help='write --profile-file every SEC seconds')
+
         argv = commandline.split (' ') if commandline else sys.argv[1:]
 
         self.opts, self.args = opts, args = parser.parse_args (argv)
 
+        try:
+            self.filters = filters.from_options (opts)
+        except ValueError as e:
+            parser.error (str (e))
+        self.filter_initially = bool (self.filters)
+        if not self.filters:
+            self.filters = filters.filter_bank (self.default_band)
+
         self.cal_dir = opts.pedestals_dir or os.curdir
         self.data_dir = opts.data_dir or os.curdir
         self.plots_dir = opts.plot_dir or os.curdir
+        if opts.profile:
+            self._enable_profiling ()
+        if opts.server:
+            self.client = event_server.EventClient (opts.server)
+        else:
+            self.client = None
         self._clear ()
 
         if opts.pedestals_file:
             self.load_cal (opts.pedestals_file)
 
+        if opts.timing_file:
+            self.load_tcal (opts.timing_file)
+
         if self.opts.first_file:
             options = sorted (glob ('ev*.dat')) \
                     + sorted (glob ('*/ev*.dat')) \
@@ -181,11 +511,26 @@ class Window (object):
         elif len (args) == 1:
             self.load_data (args[0])
 
+    def _enable_profiling (self):
+        """Install instrument hooks for decoding, calibration and plots."""
+        opts = self.opts
+        instrument.enable (memory=opts.profile_memory)
+        for name in ('_get_ws', '_plot_event_wf', '_plot_event_fft',
+                '_plot_event_hilbert', '_plot_event_xcorr',
+                '_plot_event_overlay'):
+            instrument.wrap (Window, name)
+        instrument.wrap (FigureCanvas, 'draw', 'canvas.draw')
+        if opts.profile_file:
+            instrument.start_writer (
+                    opts.profile_file, opts.profile_interval)
+
     def _clear (self):
         self.window = None
         self.title = 'PyAraDisplay'
         self.cal = None
+        self.tcal = None
         self.dsm = None
+        self.follow_id = None
         self.n = -1
         self.menu = Vars ()
         self.el = Vars ()
@@ -223,6 +568,8 @@ class Window (object):
             ('File', None, '_File', None, None, None),
             ('Open pedestals', None, 'Open _pedestals', '<control>p', None,
                 self._cb_open_cal), 
+            ('Open timing', None, 'Open _timing calibration', '<control>t',
+                None, self._cb_open_tcal), 
             ('Open data', None, 'Open _data', '<control>o', None,
                 self._cb_open_data), 
             ('Save plots', Gtk.STOCK_SAVE, '_Save plots', '<control>s', None,
@@ -237,6 +584,13 @@ class Window (object):
                 '<control>e', None, self._cb_update_plots, True),
             ('mean', None, 'Subtract _mean of waveform',
                 '<control>u', None, self._cb_update_plots, False),
+            ('filter', None, 'Filter _waveforms',
+                '<control>g', None, self._cb_update_plots,
+                self.filter_initially),
+            ('bands', None, 'Overlay median and percentile _bands',
+                '<control>b', None, self._cb_update_plots, True),
+            ('newest', None, 'Jump to _newest event',
+                '<control>n', None, self._cb_follow_newest, True),
             ('fullscreen', None, '_Fullscreen',
                 'F11', None, self._cb_fullscreen, False),
             ]
@@ -247,12 +601,16 @@ class Window (object):
 
         self.menu.equally_action = get_action ('equally')
         self.menu.mean_action = get_action ('mean')
+        self.menu.bands_action = get_action ('bands')
+        self.menu.filter_action = get_action ('filter')
+        self.menu.newest_action = get_action ('newest')
         self.menu.fullscreen_action = get_action ('fullscreen')
         self.menu.ui = """
         <ui>
             <menubar name="MenuBar">
                 <menu action="File">
                     <menuitem action = "Open pedestals" />
+                    <menuitem action = "Open timing" />
                     <menuitem action = "Open data" />
                     <menuitem action = "Save plots" />
                     <separator />
@@ -261,7 +619,10 @@ class Window (object):
                 <menu action="View">
                     <menuitem action = "equally" />
                     <menuitem action = "mean" />
+                    <menuitem action = "filter" />
+                    <menuitem action = "bands" />
                     <separator />
+                    <menuitem action = "newest" />
                     <menuitem action = "fullscreen" />
                 </menu>
             </menubar>
@@ -289,6 +650,9 @@ class Window (object):
                 'FFT (linear-y)',
                 'FFT (semilog-y)',
                 'Hilbert',
+                'Cross-correlation',
+                'Overlay waveforms',
+                'Overlay spectra',
                 ]
         if not self.events.ag is None:
             self.uim.remove_action_group (self.events.ag)
@@ -315,12 +679,24 @@ class Window (object):
             self.events.ag.add_actions ([
                 ('hilbert', None, 'hilbert', '<control>h', None,
                     self._cb_events_combo_switch) ], 3)
+            self.events.ag.add_actions ([
+                ('xcorr', None, 'xcorr', '<control>x', None,
+                    self._cb_events_combo_switch) ], 4)
+            self.events.ag.add_actions ([
+                ('overlay_wf', None, 'overlay_wf', '<control>l', None,
+                    self._cb_events_combo_switch) ], 5)
+            self.events.ag.add_actions ([
+                ('overlay_fft', None, 'overlay_fft', '<control>k', None,
+                    self._cb_events_combo_switch) ], 6)
             self.events.ui = """
             <ui>
                 <accelerator action="wf" />
                 <accelerator action="fft_linear" />
                 <accelerator action="fft_semilogy" />
                 <accelerator action="hilbert" />
+                <accelerator action="xcorr" />
+                <accelerator action="overlay_wf" />
+                <accelerator action="overlay_fft" />
             </ui>
             """
             self.uim.insert_action_group (self.events.ag, -1)
@@ -331,6 +707,9 @@ class Window (object):
             self.events.combo.append_text ('FFT (linear) [Ctrl-F]')
             self.events.combo.append_text ('FFT (semilog-y) [Ctrl-Y]')
             self.events.combo.append_text ('Hilbert [Ctrl-H]')
+            self.events.combo.append_text ('Cross-correlation [Ctrl-X]')
+            self.events.combo.append_text ('Overlay waveforms [Ctrl-L]')
+            self.events.combo.append_text ('Overlay spectra [Ctrl-K]')
             self.events.combo.connect ('changed', self._cb_update_plots)
             self.events.figure = mpl.figure.Figure (
                     figsize=(3,3), dpi=50, facecolor='.85')
@@ -342,26 +721,47 @@ class Window (object):
         if self.dsm:
             self.el.tv = Gtk.TreeView (model=self.dsm)
             self.el.tv.connect ('cursor-changed', self._cb_update_plots)
+            # several rows may be selected for the overlay plots
+            self.el.tv.get_selection ().set_mode (Gtk.SELECTION_MULTIPLE)
             self.el.sw = Gtk.ScrolledWindow ()
-            self.el.sw.add_with_viewport (self.el.tv)
+            # TreeView scrolls by itself; inside a viewport it would have
+            # to lay out every row
+            self.el.sw.add (self.el.tv)
             self.el.sw.set_size_request (300, 10)
             self.el.frame = Gtk.Frame ()
             self.el.frame.add (self.el.sw)
+            self.el.jump = Gtk.Entry ()
+            self.el.jump.set_placeholder_text ('jump to event id')
+            self.el.jump.connect ('activate', self._cb_jump_to_event_id)
+            self.el.filter = Gtk.Entry ()
+            self.el.filter.set_placeholder_text (
+                    'filter, e.g. snr > 6, nblk == 32')
+            self.el.filter.connect ('activate', self._cb_filter_event_list)
             cur = self.main_hpane.get_child2 ()
             if cur:
                 self.main_hpane.remove (cur)
             vbox = Gtk.VBox (False, 4)
+            vbox.pack_start (self.el.jump, expand=False)
+            vbox.pack_start (self.el.filter, expand=False)
             vbox.pack_start (self.el.frame, expand=True)
             self.main_hpane.pack2 (vbox, resize=True, shrink=False)
             self.el.tv.get_selection ().select_path (0)
-            cell = Gtk.CellRendererText ()
-            column = Gtk.TreeViewColumn (
-                    'unix time', cell, text=0)
-            self.el.tv.insert_column (column, 0)
-            cell = Gtk.CellRendererText ()
-            column = Gtk.TreeViewColumn (
-                    'event id', cell, text=1)
-            self.el.tv.insert_column (column, 1)
+            for col, (title, name) in enumerate (self.dsm.columns):
+                cell = Gtk.CellRendererText ()
+                column = Gtk.TreeViewColumn (title, cell, text=col)
+                column.set_sizing (Gtk.TreeViewColumnSizing.FIXED)
+                column.set_fixed_width (self.event_list_widths.get (name, 80))
+                column.set_resizable (True)
+                column.set_clickable (True)
+                column.connect ('clicked', self._cb_sort_event_list, name)
+                self.el.tv.insert_column (column, col)
+            cell = SparklineRenderer (self.dsm)
+            column = Gtk.TreeViewColumn ('envelope', cell)
+            column.set_cell_data_func (cell, self._cell_sparkline)
+            column.set_sizing (Gtk.TreeViewColumnSizing.FIXED)
+            column.set_fixed_width (self.dsm.sparkline_size[0] + 10)
+            self.el.tv.insert_column (column, 2)
+            self.el.tv.set_fixed_height_mode (True)
         else:
             self.main_hpane.add2 (Gtk.HBox ())
         self.window.show_all ()
@@ -372,10 +772,21 @@ class Window (object):
     def load_cal (self, filename):
         """Load a pedestals file."""
         self.cal_dir = os.path.dirname (filename)
-        with open (filename) as f:
-            self.cal = aradecode.ped_cal (f)
+        self.cal = aradecode.ped_cal.from_file (filename)
         print ('Loaded pedestals from "{0}".'.format (filename))
-        if self.dsm:
+        if self.dsm is not None:
+            self.dsm.clear_results ()
+            self._start_analysis ()
+            self._cb_update_plots (None)
+
+    def load_tcal (self, filename):
+        """Load a sample timing calibration file."""
+        self.cal_dir = os.path.dirname (filename)
+        self.tcal = aradecode.time_cal.from_file (filename)
+        print ('Loaded timing calibration from "{0}".'.format (filename))
+        if self.dsm is not None:
+            self.dsm.clear_results ()
+            self._start_analysis ()
             self._cb_update_plots (None)
 
     def load_data (self, filename):
@@ -405,11 +816,19 @@ class Window (object):
             response = dialog.run ()
             dialog.destroy ()
             return
-        self.dsm = DataSetModel (filename)
+        if self.follow_id is not None:
+            GLib.source_remove (self.follow_id)
+            self.follow_id = None
+        self.dsm = DataSetModel (filename, follow=self.opts.follow,
+                client=self.client)
         print ('Loaded data from "{0}".'.format (filename))
         self._setup_event_list ()
         self._setup_event_plots ()
         self._cb_update_plots (None)
+        self._start_analysis ()
+        if self.opts.follow and self.client is None:
+            self.follow_id = GLib.timeout_add (
+                    int (1000 * self.opts.follow_interval), self._cb_follow)
 
 
     def _set_title (self, title):
@@ -420,12 +839,37 @@ class Window (object):
     def _get_selected_event_number (self):
         model, path = self.el.tv.get_selection ().get_selected_rows ()
         if path:
-            return path[0][0]
+            return int (self.dsm.order[path[0][0]])
+        elif len (self.dsm.order):
+            return int (self.dsm.order[0])
         else:
             return 0
 
+    def _get_selected_event_numbers (self):
+        """Event indices for the overlay plots.
+
+        These are the selected rows, or if at most one row is selected, all
+        rows currently shown; either way at most overlay_max_events.
+        """
+        model, paths = self.el.tv.get_selection ().get_selected_rows ()
+        if len (paths) > 1:
+            rows = [path[0] for path in paths]
+        else:
+            rows = slice (None)
+        return self.dsm.order[rows][:self.overlay_max_events]
+
+    def _select_event (self, index):
+        """Move the event list cursor to event index, if it is shown."""
+        row = self.dsm.row_of (index)
+        if row is not None:
+            self.el.tv.set_cursor ((row,))
+            self.el.tv.scroll_to_cell ((row,))
+
     def _plot_event (self, fig):
         """Plot the event."""
+        if not len (self.dsm.events):
+            # e.g. a followed file that has no complete event yet
+            return
         active = self.events.combo.get_active ()
         if active == 0:
             self._plot_event_wf (fig)
@@ -435,156 +879,12 @@ class Window (object):
             self._plot_event_fft (fig, log=True)
         elif active == 3:
             self._plot_event_hilbert (fig)
-
-    def _get_ws (self, ev):
-        ws = np.array ([[ev.get_waveform (dda, chan, self.cal)
-            for dda in range (4)]
-            for chan in self.channels[ev.station_id]])
-        if self.menu.mean_action.get_active ():
-            ws = (ws.T - ws.mean (axis=-1).T).T
-        return ws
-
-    def _plot_event_wf (self, fig):
-        n = self._get_selected_event_number ()
-        ev = self.dsm.events[n]
-        station = ev.station_id
-
-        fig.clf ()
-        ws = self._get_ws (ev)
-        y_extrema = np.max (np.max (np.abs (ws), axis=-1), axis=1)
-        for chan in range (4):
-            for dda in range (4):
-                which = 4 * chan + dda + 1
-                ax = fig.add_subplot (4, 4, which)
-                w = ws[chan][dda]
-                t = np.arange (len (w)) / 3.2  # rough approximation!
-                ax.plot (t, w, '-', lw=.5)
-                ax.xaxis.set_major_locator (
-                        mpl.ticker.MaxNLocator (nbins=4))
-                ax.yaxis.set_major_locator (
-                        mpl.ticker.MaxNLocator (nbins=6, symmetric=True))
-                if chan < 3:
-                    ax.set_xticklabels ([])
-                if dda > 0:
-                    ax.set_yticklabels ([])
-                # NOTE: this works because we do not account for cable delays
-                ax.set_xlim (0, t.max ())
-                if self.menu.equally_action.get_active ():
-                    ax.set_ylim (-y_extrema[chan], y_extrema[chan])
-                else:
-                    ax.set_yticklabels ([])
-                    extremum = max (ax.get_ylim ())
-                    ax.set_ylim (-extremum, extremum)
-                ax.grid (color='.7', zorder=-10)
-                if dda == 0:
-                    ax.set_ylabel (self.channel_labels[chan])
-                if chan == 0:
-                    ax.set_title ('DDA {0}'.format (dda + 1))
-        fig.subplots_adjust (**self.subplot_args)
-
-    def _plot_event_fft (self, fig, log):
-        n = self._get_selected_event_number ()
-        ev = self.dsm.events[n]
-
-        fig.clf ()
-
-        def get_fft (w):
-            basic_amplitudes = np.fft.rfft (w)
-            amplitudes = basic_amplitudes.T[:-1].T
-            return amplitudes
-
-        def get_fftfreqs (w):
-            t_range = len (w) / 3.2  # ns, rough approximation!
-            n = len (w)
-            dt = 1e-9 * t_range / n
-            frequencies = np.fft.fftfreq (n)[:n/2] / dt # Hz
-            return frequencies
-
-        ws = self._get_ws (ev)
-        ffts = np.abs (get_fft (ws)).T[1:].T
-        fftfreqs = get_fftfreqs (ws[0][0])[1:] / 1e6 # in MHz
-        ymax = np.max (np.max (ffts, axis=-1), axis=1)
-        ymin = np.min (np.min (ffts, axis=-1), axis=1)
-        for chan in range (4):
-            for dda in range (4):
-                which = 4 * chan + dda + 1
-                ax = fig.add_subplot (4, 4, which)
-                plot = ax.semilogy if log else ax.plot
-                plot (fftfreqs, ffts[chan][dda], '-', lw=.5)
-                ax.xaxis.set_major_locator (
-                        mpl.ticker.MaxNLocator (nbins=4))
-                ax.yaxis.set_major_locator (
-                        mpl.ticker.MaxNLocator (nbins=4))
-                if chan < 3:
-                    ax.set_xticklabels ([])
-                if dda > 0:
-                    ax.set_yticklabels ([])
-                ax.set_xlim (0, 1000)
-                the_ymin = ymin[chan] if log else 0
-                if self.menu.equally_action.get_active ():
-                    ax.set_ylim (the_ymin, 1.05 * ymax[chan])
-                else:
-                    ax.set_ylim (the_ymin, 1.05 * ffts[chan][dda].max ())
-                    ax.set_yticklabels ([])
-                ax.grid (color='.7', zorder=-10)
-                if dda == 0:
-                    ax.set_ylabel (self.channel_labels[chan])
-                if chan == 0:
-                    ax.set_title ('DDA {0}'.format (dda + 1))
-        fig.subplots_adjust (**self.subplot_args)
-
-    def _plot_event_fft_semilogy (self, fig):
-        self._plot_event_fft (fig)
-        n = self._get_selected_event_number ()
-        ev = self.dsm.events[n]
-        channels = self.channels[ev.station_id]
-        channel_positions = self.channel_positions[ev.station_id]
-        for chan in range (4):
-            for dda in range (4):
-                which = 4 * chan + dda + 1
-                ax = fig.add_subplot (4, 4, which)
-                ax.set_ylim (ymin=1)
-                ax.set_yscale ('log')
-                if chan < 3:
-                    ax.set_xticklabels ([])
-                if dda > 0:
-                    ax.set_yticklabels ([])
-
-    def _plot_event_hilbert (self, fig):
-        n = self._get_selected_event_number ()
-        ev = self.dsm.events[n]
-
-        fig.clf ()
-
-        ws = self._get_ws (ev)
-        hilberts = np.abs (scipy.signal.hilbert (ws))
-        y_extrema = np.max (np.max (hilberts.T[1:].T, axis=-1), axis=1)
-        t = np.arange (len (hilberts[0,0])) / 3.2  # rough approximation!
-        for chan in range (4):
-            for dda in range (4):
-                which = 4 * chan + dda + 1
-                ax = fig.add_subplot (4, 4, which)
-                ax.plot (t, hilberts[chan][dda], '-', lw=.5)
-                ax.xaxis.set_major_locator (
-                        mpl.ticker.MaxNLocator (nbins=4))
-                ax.yaxis.set_major_locator (
-                        mpl.ticker.MaxNLocator (nbins=4))
-                if chan < 3:
-                    ax.set_xticklabels ([])
-                if dda > 0:
-                    ax.set_yticklabels ([])
-                ax.set_xlim (0, t.max ())
-                if self.menu.equally_action.get_active ():
-                    ax.set_ylim (0, y_extrema[chan])
-                else:
-                    ax.set_yticklabels ([])
-                ax.grid (color='.7', zorder=-10)
-                if dda == 0:
-                    ax.set_ylabel (self.channel_labels[chan])
-                if chan == 0:
-                    ax.set_title ('DDA {0}'.format (dda + 1))
-        fig.subplots_adjust (**self.subplot_args)
-        
+        elif active == 4:
+            self._plot_event_xcorr (fig)
+        elif active == 5:
+            self._plot_event_overlay (fig, spectra=False)
+        elif active == 6:
+            self._plot_event_overlay (fig, spectra=True)
 
     def _cb_delete_event (self, widget, event, *args):
         """Handle the X11 delete event."""
@@ -597,6 +897,168 @@ class Window (object):
         else:
             self.window.unfullscreen ()
 
+    def _cb_follow (self):
+        """Pick up events appended to the data file since the last check."""
+        dsm = self.dsm
+        index = self._get_selected_event_number ()
+        n = dsm.poll ()
+        if n:
+            start = len (dsm.events) - n
+            if dsm.filter is not None or dsm.sort_column is not None:
+                self._refresh_event_list (index)
+            self._start_analysis (start)
+            if not start:
+                # nothing could be plotted so far
+                self._cb_update_plots (None)
+            if self.menu.newest_action.get_active ():
+                self._cb_follow_newest (None)
+        return True
+
+    def _cb_follow_newest (self, whence, *args):
+        if not (self.dsm and self.dsm.events):
+            return
+        if self.menu.newest_action.get_active ():
+            self._select_event (len (self.dsm.events) - 1)
+
+    def _cb_jump_to_event_id (self, entry, *args):
+        try:
+            event_id = int (entry.get_text ())
+        except ValueError:
+            return
+        index = self.dsm.find_event_id (event_id)
+        if index is not None:
+            self._select_event (index)
+
+    def _cb_filter_event_list (self, entry, *args):
+        index = self._get_selected_event_number ()
+        try:
+            self.dsm.set_filter (entry.get_text ())
+        except ValueError as e:
+            print ('Filter: {0}'.format (e))
+            return
+        self._refresh_event_list (index)
+
+    def _refresh_event_list (self, index):
+        """Show the rows of a rearranged model and select event index."""
+        # cheaper than announcing every removed and added row
+        self.el.tv.set_model (None)
+        self.el.tv.set_model (self.dsm)
+        self._select_event (index)
+
+    def _start_analysis (self, start=0):
+        """Compute features and sparkline envelopes of events[start:] in the
+        background.
+
+        Both come from a single decoding and calibration of each event.
+        Events the event list has asked for come first, then the rest in
+        order; results reach the model in batches via the main loop.
+        Features of a whole file are loaded from, and saved to, its cache.
+        """
+        dsm, cal, tcal = self.dsm, self.cal, self.tcal
+        # events are decoded by the worker; in follow mode more may arrive
+        events = dsm.events
+        stop = len (events)
+        if cal is None or start >= stop:
+            return
+        filename = dsm.filename
+        channels = self.channels[dsm.station_id]
+        generation = dsm.generation
+        batch_size = self.analysis_batch
+        cache = not start and tcal is None and os.path.isfile (filename)
+        def work ():
+            table = None
+            if cache:
+                table = features.load_cached (filename, cal, channels)
+            if table is not None and len (table) == stop:
+                GLib.idle_add (self._cb_analysis_ready, dsm, generation,
+                        np.arange (stop), features.event_columns (table),
+                        None)
+                GLib.idle_add (self._cb_features_done, dsm, generation)
+                table = None
+            else:
+                table = np.zeros (stop - start,
+                        features.table_dtype (4 * len (channels)))
+            todo = np.zeros (stop, bool)
+            todo[start:] = True
+            next_i = start
+            while True:
+                if dsm.generation != generation:
+                    return
+                batch = []
+                while dsm.sparkline_wanted and len (batch) < batch_size:
+                    try:
+                        i = dsm.sparkline_wanted.pop ()
+                    except IndexError:
+                        break
+                    if start <= i < stop and todo[i]:
+                        todo[i] = False
+                        batch.append (i)
+                while next_i < stop and len (batch) < batch_size:
+                    if todo[next_i]:
+                        todo[next_i] = False
+                        batch.append (next_i)
+                    next_i += 1
+                if not batch:
+                    break
+                batch_events = [events[i] for i in batch]
+                if table is None:
+                    columns = None
+                    values = features.envelopes (batch_events, cal,
+                            channels, tcal=tcal, n_points=dsm.sparkline_points)
+                else:
+                    part, values = features.compute_events (batch_events,
+                            cal, channels, tcal=tcal,
+                            n_points=dsm.sparkline_points)
+                    table[np.array (batch) - start] = part
+                    columns = features.event_columns (part)
+                GLib.idle_add (self._cb_analysis_ready,
+                        dsm, generation, batch, columns, values)
+            if table is not None:
+                if cache:
+                    features.save_cached (filename, cal, channels, table)
+                GLib.idle_add (self._cb_features_done, dsm, generation)
+        thread = threading.Thread (target=work)
+        thread.daemon = True
+        thread.start ()
+
+    def _cb_analysis_ready (self, dsm, generation, indices, columns, values):
+        if dsm is self.dsm and generation == dsm.generation:
+            if columns is not None:
+                dsm.set_features (indices, columns)
+            if values is not None:
+                dsm.set_sparklines (indices, values)
+            self.el.tv.queue_draw ()
+        return False
+
+    def _cb_features_done (self, dsm, generation):
+        """Filter and sort again once a worker has all its features."""
+        if dsm is not self.dsm or generation != dsm.generation:
+            return False
+        if dsm.filter is not None:
+            # also sorts again
+            self._cb_filter_event_list (self.el.filter)
+        elif dsm.sort_column in features.names:
+            index = self._get_selected_event_number ()
+            dsm.sort_by (dsm.sort_column, dsm.sort_descending)
+            self._select_event (index)
+        return False
+
+    def _cell_sparkline (self, column, cell, model, it, *data):
+        row = model.get_path (it)[0]
+        cell.set_property ('event', int (self.dsm.order[row]))
+
+    def _cb_sort_event_list (self, column, name):
+        index = self._get_selected_event_number ()
+        descending = self.dsm.sort_column == name \
+                and not self.dsm.sort_descending
+        self.dsm.sort_by (name, descending)
+        for c in self.el.tv.get_columns ():
+            c.set_sort_indicator (False)
+        column.set_sort_indicator (True)
+        column.set_sort_order (Gtk.SortType.DESCENDING if descending
+                else Gtk.SortType.ASCENDING)
+        self._select_event (index)
+
     def _cb_events_combo_switch (self, whence, data, *args):
         self.events.combo.set_active (data)
         self._cb_update_plots (self.events.combo)
@@ -614,6 +1076,10 @@ class Window (object):
         filt.add_pattern ('*.dat')
         dialog.add_filter (filt)
         filt = Gtk.FileFilter ()
+        filt.set_name ('Binary pedestal tables')
+        filt.add_pattern ('*.npy')
+        dialog.add_filter (filt)
+        filt = Gtk.FileFilter ()
         filt.set_name ('All Files')
         filt.add_pattern ('*')
         dialog.add_filter (filt)
@@ -626,6 +1092,33 @@ class Window (object):
         if filename:
             self.load_cal (filename)
 
+    def _cb_open_tcal (self, whence, *args):
+        """Handle the 'Open timing calibration' action."""
+        dialog = Gtk.FileChooserDialog ('Open timing calibration...',
+                None, Gtk.FILE_CHOOSER_ACTION_OPEN,
+                (Gtk.STOCK_CANCEL, Gtk.RESPONSE_CANCEL,
+                 Gtk.STOCK_OPEN, Gtk.RESPONSE_OK))
+        dialog.set_current_folder (self.cal_dir)
+        dialog.set_default_response (Gtk.RESPONSE_OK)
+        filt = Gtk.FileFilter ()
+        filt.set_name ('Timing calibration files')
+        filt.add_pattern ('*.txt')
+        filt.add_pattern ('*.dat')
+        filt.add_pattern ('*.npy')
+        dialog.add_filter (filt)
+        filt = Gtk.FileFilter ()
+        filt.set_name ('All Files')
+        filt.add_pattern ('*')
+        dialog.add_filter (filt)
+        response = dialog.run ()
+        if response == Gtk.RESPONSE_OK:
+            filename = dialog.get_filename ()
+        else:
+            filename = None
+        dialog.destroy ()
+        if filename:
+            self.load_tcal (filename)
+
     def _cb_open_data (self, whence, *args):
         """Handle the 'Open data' action."""
         dialog = Gtk.FileChooserDialog (title='Open...',
@@ -691,9 +1184,15 @@ class Window (object):
 
     def _cb_update_plots (self, widget, *args):
         """Update whatever plots need updating."""
+        alloc = self.events.canvas.get_allocation ()
         self.events.vbox.remove (self.events.canvas)
         self.events.figure = mpl.figure.Figure (
                 figsize=(3,3), dpi=50, facecolor='.85')
+        if alloc.width > 1:
+            # start at the size the canvas will get, so plots that depend
+            # on the pixel size (overlay decimation) get it right
+            self.events.figure.set_size_inches (
+                    alloc.width / 50., alloc.height / 50.)
         self._plot_event (self.events.figure)
         self.events.canvas = FigureCanvas (self.events.figure)
         self.events.vbox.pack_start (self.events.canvas)
@@ -701,6 +1200,9 @@ class Window (object):
         self.window.show_all ()
 
     def _cb_quit (self, whence, *args):
+        if self.opts.profile:
+            instrument.stop_writer ()
+            print (instrument.report ())
         Gtk.main_quit ()
 
 
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# run_summary.py
+
+
+from __future__ import print_function
+
+__doc__ = """Summarize the health of ARA runs from event headers.
+
+Headers of all given .dat files are scanned in parallel (samples are skipped,
+not decoded), and the combined stream is checked for event rates, trigger
+breakdowns, PPS and timestamp continuity, readout block counts and gaps in
+event_id.  Unix times far from the rest of the run are reported as
+implausible rather than used for the duration and rates.  The report is
+printed; --json and --plots save it as well.
+"""
+
+import collections
+import datetime
+import json
+import multiprocessing
+import numpy as np
+import optparse
+import os
+
+import aradecode
+
+
+def scan (filenames, jobs=1):
+    """Return the concatenated header table and the events per file."""
+    if jobs > 1 and len (filenames) > 1:
+        pool = multiprocessing.Pool (jobs)
+        tables = pool.map (aradecode.read_headers, filenames)
+        pool.close ()
+        pool.join ()
+    else:
+        tables = list (map (aradecode.read_headers, filenames))
+    headers = np.concatenate (tables) if tables \
+            else np.zeros (0, aradecode.store_header_dtype)
+    return headers, [len (t) for t in tables]
+
+def _counts (values):
+    """Return {value: count}, most common first, with str keys for JSON."""
+    counter = collections.Counter (values)
+    return collections.OrderedDict (
+            (str (k), n) for k, n in counter.most_common ())
+
+def plausible (headers, max_offset=86400):
+    """Return which headers have a unix time within max_offset s of the median.
+
+    A corrupt unix value far from the rest of the run must not stretch its
+    duration or rate binning.
+    """
+    unix = headers['unix'].astype (np.int64)
+    if not len (unix):
+        return np.zeros (0, bool)
+    return np.abs (unix - int (np.median (unix))) <= max_offset
+
+def per_second (unix):
+    """Return (seconds with events, their event counts, empty seconds)."""
+    seconds, counts = np.unique (unix, return_counts=True)
+    empty = int ((np.diff (seconds) - 1).sum ())
+    return seconds, counts, empty
+
+def _median_with_zeros (counts, n_zeros):
+    """Return the median of counts together with n_zeros zeros."""
+    counts = np.sort (counts)
+    total = len (counts) + n_zeros
+    middle = [(total - 1) // 2, total // 2]
+    return float (np.mean ([counts[k - n_zeros] if k >= n_zeros else 0
+        for k in middle]))
+
+def summarize (headers, max_listed=20, max_offset=86400):
+    """Return a JSON-able dict of run health numbers."""
+    n = len (headers)
+    summary = collections.OrderedDict (n_events=n)
+    if not n:
+        return summary
+    ok = plausible (headers, max_offset)
+    bad = np.flatnonzero (~ok)
+    summary['implausible_times'] = collections.OrderedDict (
+            count=int (len (bad)),
+            at_event_id=headers['event_id'][bad][:max_listed].tolist (),
+            unix=headers['unix'][bad][:max_listed].tolist ())
+    good = headers[ok]
+    t = good['unix'] + 1e-6 * good['unix_us']
+    seconds, counts, empty = per_second (good['unix'])
+    span = t.max () - t.min ()
+    summary['start'] = str (datetime.datetime.utcfromtimestamp (t.min ()))
+    summary['stop'] = str (datetime.datetime.utcfromtimestamp (t.max ()))
+    summary['duration_s'] = float (span)
+    summary['rate_hz'] = collections.OrderedDict (
+            mean=float (len (good) / span) if span > 0 else 0.,
+            min=0 if empty else int (counts.min ()),
+            median=_median_with_zeros (counts, empty),
+            max=int (counts.max ()))
+    summary['empty_seconds'] = empty
+    summary['trigger_info'] = _counts (
+            map (tuple, headers['trigger_info'].tolist ()))
+    summary['trigger_blk'] = _counts (
+            map (tuple, headers['trigger_blk'].tolist ()))
+    summary['nblk'] = _counts (headers['nblk'].tolist ())
+    summary['station_id'] = _counts (headers['station_id'].tolist ())
+
+    dt = np.diff (t)
+    back = np.flatnonzero (dt < 0)
+    summary['time_reversals'] = collections.OrderedDict (
+            count=int (len (back)),
+            at_event_id=good['event_id'][back + 1][:max_listed].tolist ())
+    dpps = np.diff (headers['pps'].astype (np.int64))
+    bad_pps = np.flatnonzero ((dpps != 0) & (dpps != 1))
+    summary['pps_jumps'] = collections.OrderedDict (
+            count=int (len (bad_pps)),
+            at_event_id=headers['event_id'][bad_pps + 1][:max_listed].tolist (),
+            size=dpps[bad_pps][:max_listed].tolist ())
+    dts = np.diff (headers['timestamp'].astype (np.int64))
+    bad_ts = np.flatnonzero ((dpps == 0) & (dts < 0))
+    summary['timestamp_reversals'] = collections.OrderedDict (
+            count=int (len (bad_ts)),
+            at_event_id=headers['event_id'][bad_ts + 1][:max_listed].tolist ())
+    did = np.diff (headers['event_id'].astype (np.int64))
+    gaps = np.flatnonzero (did != 1)
+    summary['event_id_gaps'] = collections.OrderedDict (
+            count=int (len (gaps)),
+            missing=int (np.clip (did[gaps] - 1, 0, None).sum ()),
+            after_event_id=headers['event_id'][gaps][:max_listed].tolist (),
+            size=did[gaps][:max_listed].tolist ())
+    return summary
+
+def format_report (summary, files):
+    lines = []
+    for filename, n in files:
+        lines.append ('{0:8d} events  {1}'.format (n, filename))
+    lines.append ('')
+    lines.append ('{0} events'.format (summary['n_events']))
+    if not summary['n_events']:
+        return '\n'.join (lines)
+    rate = summary['rate_hz']
+    lines.append ('{0} -- {1} ({2:.0f} s)'.format (
+        summary['start'], summary['stop'], summary['duration_s']))
+    lines.append ('rate: {0:.2f} Hz mean; per second min {1} / median {2:g} '
+            '/ max {3}; {4} empty seconds'.format (rate['mean'], rate['min'],
+                rate['median'], rate['max'], summary['empty_seconds']))
+    for key in ('trigger_info', 'trigger_blk', 'nblk', 'station_id'):
+        counts = summary[key]
+        shown = list (counts.items ())[:8]
+        more = ', ...' if len (counts) > len (shown) else ''
+        lines.append ('{0}: {1}{2}'.format (key, ', '.join (
+            '{0} x{1}'.format (k, n) for k, n in shown), more))
+    for key in ('implausible_times', 'time_reversals', 'pps_jumps',
+            'timestamp_reversals', 'event_id_gaps'):
+        entry = summary[key]
+        details = ', '.join ('{0}={1}'.format (k, v)
+                for k, v in entry.items () if k != 'count' and v)
+        lines.append ('{0}: {1}{2}'.format (key, entry['count'],
+            ' ({0})'.format (details) if details else ''))
+    return '\n'.join (lines)
+
+def plot (headers, filename, max_offset=86400):
+    """Save rate, nblk and trigger plots to filename."""
+    import matplotlib
+    matplotlib.use ('Agg')
+    import matplotlib.pyplot as plt
+    fig, axs = plt.subplots (3, 1, figsize=(8, 9))
+    if len (headers):
+        seconds, counts, empty = per_second (
+                headers['unix'][plausible (headers, max_offset)])
+        axs[0].plot (seconds - seconds[0], counts, '.', ms=2)
+        nblk, n = np.unique (headers['nblk'], return_counts=True)
+        axs[1].bar (nblk, n)
+        trig = _counts (map (tuple, headers['trigger_info'].tolist ()))
+        labels = list (trig)[:10]
+        axs[2].barh (np.arange (len (labels)), [trig[k] for k in labels])
+        axs[2].set_yticks (np.arange (len (labels)))
+        axs[2].set_yticklabels (labels, fontsize='small')
+    axs[0].set_xlabel ('seconds since run start')
+    axs[0].set_ylabel ('events per second')
+    axs[1].set_xlabel ('nblk')
+    axs[1].set_ylabel ('events')
+    axs[2].set_xlabel ('events')
+    axs[2].set_ylabel ('trigger_info')
+    fig.tight_layout ()
+    fig.savefig (filename)
+    plt.close (fig)
+
+
+def main ():
+    usage = '%prog {[options]} [infile] {[infile]...}'
+    parser = optparse.OptionParser (usage=usage, description=__doc__)
+    parser.add_option ('-j', '--jobs', dest='jobs',
+            default=multiprocessing.cpu_count (), type=int, metavar='N',
+            help='scan up to N files in parallel')
+    parser.add_option ('--json', dest='json',
+            default='', metavar='FILE',
+            help='also write the summary to FILE as JSON')
+    parser.add_option ('--plots', dest='plots',
+            default='', metavar='FILE',
+            help='save rate, nblk and trigger plots to FILE')
+    parser.add_option ('--max-listed', dest='max_listed',
+            default=20, type=int, metavar='N',
+            help='list at most N event ids per problem')
+    parser.add_option ('--max-offset', dest='max_offset',
+            default=86400, type=int, metavar='SECONDS',
+            help='report unix times further than SECONDS from the median '
+            'as implausible and leave them out of times and rates')
+
+    opts, args = parser.parse_args ()
+    if not args:
+        parser.error ('must provide at least one input file')
+    for infile in args:
+        if not os.path.isfile (infile):
+            parser.error ('could not find "{0}"'.format (infile))
+
+    headers, n_per_file = scan (args, jobs=opts.jobs)
+    summary = summarize (headers, max_listed=opts.max_listed,
+            max_offset=opts.max_offset)
+    print (format_report (summary, zip (args, n_per_file)))
+    if opts.json:
+        summary['files'] = collections.OrderedDict (zip (args, n_per_file))
+        with open (opts.json, 'w') as f:
+            json.dump (summary, f, indent=2)
+        print ('Wrote summary to "{0}".'.format (opts.json))
+    if opts.plots:
+        plot (headers, opts.plots, opts.max_offset)
+        print ('Wrote plots to "{0}".'.format (opts.plots))
+
+
+if __name__ == '__main__':
+    main ()
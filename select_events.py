@@ -4,10 +4,20 @@
 
 from __future__ import print_function
 
-__doc__ = """Select events for a new file"""
+__doc__ = """Select events for a new file
+
+Selected events are appended to the output as each input file is read.  With
+--job-file, the inputs that have been completed (keyed by path, size and
+mtime) and the output they produced are recorded after every input, so a
+rerun skips them: an interrupted job picks up where it stopped, and rerunning
+a daily job with a few new inputs only reads those.  An input that changed
+after it was done is refused, since its earlier events are already in the
+output; if it only grew, --force reads just the events added to it.
+"""
 
 import datetime
 import gzip
+import json
 import numpy as np
 import optparse
 import os
@@ -18,6 +28,7 @@ import sys
 from glob import glob
 
 import aradecode
+import instrument
 from vars_class import Vars
 
 @np.vectorize
@@ -28,7 +39,7 @@ def timedelta_in_seconds (dt):
 
 class Select (object):
 
-    def run (self):
+    def run (self, argv=None):
         usage = '%prog {[options]} [outfile_base] [infile] {[infile]...}'
         self.parser = parser = optparse.OptionParser (usage=usage)
 
@@ -54,11 +65,33 @@ class Select (object):
                 default=20, type=float, metavar='DT',
                 help='skip file if first event is DT earlier than --min-time')
 
+        parser.add_option ('-j', '--job-file', dest='job_file',
+                default='', metavar='FILE',
+                help='record progress in FILE and skip inputs it lists as '
+                'done; outputs are appended to')
+        parser.add_option ('--force', dest='force',
+                default=False, action='store_true',
+                help='with --job-file, continue inputs that grew since they '
+                'were done, reading only events after those already read')
         parser.add_option ('-l', '--logfile', dest='logfile',
                 default='', metavar='FILE',
                 help='read run information from FILE')
 
-        opts, args = self.opts, self.args = parser.parse_args ()
+        parser.add_option ('--profile', dest='profile',
+                default=False, action='store_true',
+                help='time decoding stages and print a summary when done')
+        parser.add_option ('--profile-memory', dest='profile_memory',
+                default=False, action='store_true',
+                help='with --profile, also track allocations per stage')
+        parser.add_option ('--profile-file', dest='profile_file',
+                default='', metavar='FILE',
+                help='with --profile, periodically write stage statistics '
+                'to FILE as JSON')
+        parser.add_option ('--profile-interval', dest='profile_interval',
+                default=10., type=float, metavar='SEC',
+                help='write --profile-file every SEC seconds')
+
+        opts, args = self.opts, self.args = parser.parse_args (argv)
 
         if len (args) < 2:
             parser.error (
@@ -78,8 +111,18 @@ class Select (object):
         self.min_time = self.parse_times (self.opts.min_time)
         self.max_time = self.parse_times (self.opts.max_time)
 
-        self.handle_logfile ()
-        self.handle_files ()
+        if opts.profile:
+            instrument.enable (memory=opts.profile_memory)
+            if opts.profile_file:
+                instrument.start_writer (
+                        opts.profile_file, opts.profile_interval)
+        try:
+            self.handle_logfile ()
+            self.handle_files ()
+        finally:
+            if opts.profile:
+                print (instrument.report ())
+                instrument.disable ()
 
     @staticmethod
     def parse_times (time_str):
@@ -88,7 +131,7 @@ class Select (object):
             return None
         time_re = r'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})'
         m = re.match (time_re, time_str)
-        numbers = map (int,m.groups ())
+        numbers = list (map (int,m.groups ()))
         t = datetime.datetime (*numbers)
         return t
 
@@ -103,7 +146,7 @@ class Select (object):
                 if line:
                     lines.append (line)
             self.opts.part_of_second, self.opts.within = \
-                    map (float, lines[0].split ())
+                    list (map (float, lines[0].split ()))
             m = re.match (r'UTC([+-]\d+)', lines[1])
             if m:
                 lines.pop (0)
@@ -116,91 +159,220 @@ class Select (object):
                 t1 = dt + self.parse_times ('{0} {1}'.format (date1, time1))
                 t2 = dt + self.parse_times ('{0} {1}'.format (date2, time2))
                 self.time_ranges[suffix] = t1, t2
-        t1s = [time_range[0] for time_range in self.time_ranges.itervalues ()]
-        t2s = [time_range[1] for time_range in self.time_ranges.itervalues ()]
-        self.min_time = min (t1s)
-        self.max_time = max (t2s)
+        if self.time_ranges:
+            t1s = [time_range[0] for time_range in self.time_ranges.values ()]
+            t2s = [time_range[1] for time_range in self.time_ranges.values ()]
+            self.min_time = min (t1s)
+            self.max_time = max (t2s)
+
+    def selection (self):
+        """Return the settings that determine which events are kept."""
+        opts = self.opts
+        return dict (
+                outfile_base=self.outfile_base,
+                min_time=str (self.min_time), max_time=str (self.max_time),
+                part_of_second=opts.part_of_second, within=opts.within,
+                n_events=opts.n_events, pass_early=opts.pass_early,
+                time_ranges=dict ((suffix, [str (t1), str (t2)])
+                    for suffix, (t1, t2) in self.time_ranges.items ()))
+
+    def load_job (self):
+        """Load the job state, or start a new one."""
+        self.job = dict (selection=self.selection (), inputs={}, outputs={})
+        if not (self.opts.job_file and os.path.isfile (self.opts.job_file)):
+            return
+        with open (self.opts.job_file) as f:
+            job = json.load (f)
+        if job['selection'] != self.job['selection']:
+            self.parser.error ('"{0}" was written with a different selection; '
+                    'use another --job-file'.format (self.opts.job_file))
+        self.job = job
+
+    def save_job (self):
+        """Write the job state; it is replaced atomically."""
+        if not self.opts.job_file:
+            return
+        tmp = self.opts.job_file + '.tmp'
+        with open (tmp, 'w') as f:
+            json.dump (self.job, f, indent=2, sort_keys=True)
+        os.replace (tmp, self.opts.job_file)
+
+    @staticmethod
+    def input_key (infile):
+        st = os.stat (infile)
+        return dict (size=st.st_size, mtime=st.st_mtime)
+
+    def keep (self, t):
+        """Return the output suffix for an event at time t, None to drop it,
+        or False if no later event in the file can be kept."""
+        if self.min_time is not None:
+            if not self.min_time <= t:
+                early_by = timedelta_in_seconds (self.min_time - t)
+                if early_by > self.opts.pass_early:
+                    return False
+                return None
+        if self.max_time is not None:
+            if not t <= self.max_time:
+                return False
+        if self.opts.part_of_second >= 0:
+            part_of_second = 1e-6 * t.microsecond
+            dt = part_of_second - self.opts.part_of_second
+            if abs (dt) > self.opts.within:
+                return None
+        if self.time_ranges:
+            for suffix, (t1, t2) in self.time_ranges.items ():
+                if t1 <= t and t <= t2:
+                    return suffix
+            return None
+        return ''
+
+    def check_inputs (self):
+        """Return the number of events already read from each input.
+
+        Inputs done before and unchanged map to None.  Inputs that changed
+        after they were done are refused, as their events are already in the
+        output, unless they only grew and --force is given.
+        """
+        skip = {}
+        for infile in self.infiles:
+            path = os.path.realpath (infile)
+            key = self.input_key (infile)
+            done = self.job['inputs'].get (path)
+            if done is None:
+                skip[path] = 0
+            elif (done['size'], done['mtime']) == (key['size'], key['mtime']):
+                skip[path] = None
+            elif not self.opts.force:
+                self.parser.error ('"{0}" changed after it was done; events '
+                        'from it are already in the output (use --force if '
+                        'it only grew)'.format (infile))
+            elif key['size'] < done['size'] or 'n_read' not in done:
+                self.parser.error ('"{0}" changed after it was done and '
+                        'cannot be continued'.format (infile))
+            else:
+                skip[path] = done['n_read']
+        return skip
 
     def handle_files (self):
         """Handle files."""
-        blobs = dict ((suffix, [[]]) for suffix in self.time_ranges)
-        ns = dict ((suffix, 0) for suffix in self.time_ranges)
-        blobs[''] = [[]]
-        ns[''] = 0
+        self.load_job ()
+        skip = self.check_inputs ()
+        outputs = dict ((suffix, _Output (self, suffix))
+                for suffix in (self.time_ranges or ['']))
 
         print ('Handling input...')
         N = 0
         for infile in self.infiles:
-            print ('- {0} ...'.format (infile), end='')
-            n = 0
-            astr = aradecode.ara_stream (gzip.GzipFile (infile))
-            for ev in astr:
-                t = ev.get_unix_datetime ()
-                if self.min_time is not None:
-                    if not self.min_time <= t:
-                        early_by = timedelta_in_seconds (self.min_time - t)
-                        if early_by > self.opts.pass_early:
-                            break
+            path = os.path.realpath (infile)
+            key = self.input_key (infile)
+            done = self.job['inputs'].get (path)
+            if skip[path] is None:
+                print ('- {0} done before, {1} kept.'.format (
+                    infile, sum (done['kept'].values ())))
+                continue
+            if skip[path]:
+                print ('- {0} grew, skipping {1} events read before ...'
+                        .format (infile, skip[path]), end='')
+                kept = dict (done['kept'])
+            else:
+                print ('- {0} ...'.format (infile), end='')
+                kept = dict ((suffix, 0) for suffix in outputs)
+            n_kept = sum (kept.values ())
+            n_read = 0
+            astr = aradecode.ara_pipelined_stream (gzip.GzipFile (infile),
+                    types=(aradecode.atri_event_type,))
+            try:
+                for ev in astr:
+                    if n_read < skip[path]:
+                        n_read += 1
                         continue
-                if self.max_time is not None:
-                    if not t <= self.max_time:
+                    the_suffix = self.keep (ev.get_unix_datetime ())
+                    if the_suffix is False:
                         break
-                if self.opts.part_of_second >= 0:
-                    part_of_second = 1e-6 * t.microsecond
-                    dt = part_of_second - self.opts.part_of_second
-                    if abs (dt) > self.opts.within:
-                        continue
-                if self.time_ranges:
-                    the_suffix = ''
-                    for suffix, (t1, t2) in self.time_ranges.iteritems ():
-                        if t1 <= t and t <= t2:
-                            the_suffix = suffix
-                            break
-                    if not the_suffix:
+                    n_read += 1
+                    if the_suffix is None:
                         continue
-                else:
-                    the_suffix = ''
-                n += 1
-                N += 1
-                blobs[the_suffix][-1].append (ev.binary)
-                n_blob = len (blobs[the_suffix][-1])
-                if self.opts.n_events and n_blob == self.opts.n_events:
-                    blobs[the_suffix].append ([])
+                    outputs[the_suffix].write (ev.binary)
+                    kept[the_suffix] += 1
+            finally:
+                astr.close ()
+                for output in outputs.values ():
+                    output.close ()
+            n = sum (kept.values ()) - n_kept
+            N += n
+            key['kept'] = kept
+            key['n_read'] = n_read
+            self.job['inputs'][path] = key
+            self.save_job ()
             print (' {0} kept.'.format (n))
 
-
         print ('{0} events kept in total.'.format (N))
+        if self.opts.n_events == 0:
+            for output in outputs.values ():
+                output.touch ()
+        self.save_job ()
+        for suffix in sorted (outputs):
+            for outfile in sorted (self.job['outputs'][suffix]['sizes']):
+                print ('* {0}'.format (outfile))
+        print ('Done.')
 
-        print ('Writing output...')
-        for suffix in sorted (blobs):
-            if len (blobs) >= 2 and not suffix:
-                continue
-            if self.opts.n_events == 0:
-                binary = ''.join (blobs[suffix][0])
-                if suffix:
-                    ending = '_{0}.dat'.format (suffix)
-                else:
-                    ending = '.dat'
-                outfile = '{0}{1}'.format (self.outfile_base, ending)
-                print ('* {0} ...'.format (outfile))
-                f = gzip.GzipFile (outfile, 'wb')
-                f.write (binary)
-                f.close ()
-            else:
-                for n_file, file_blobs in enumerate (blobs):
-                    binary = ''.join (file_blobs)
-                    if suffix:
-                        ending = '_{0}.dat'.format (suffix)
-                    else:
-                        ending = '.dat'
-                    outfile = '{0}{1}_{2:05d}'.format (
-                            self.outfile, ending, n_file)
-                    print ('* {0} ...'.format (outfile))
-                    f = gzip.GzipFile (outfile, 'wb')
-                    f.write (binary)
-                    f.close ()
 
-        print ('Done.')
+class _Output (object):
+
+    """Appends events for one output suffix, one gzip member per input.
+
+    Output sizes are kept in the job state; before appending, a file is cut
+    back to its recorded size, dropping whatever an interrupted run wrote
+    after the last completed input.
+    """
+
+    def __init__ (self, select, suffix):
+        self.select = select
+        self.state = select.job['outputs'].setdefault (
+                suffix, dict (file=0, n=0, sizes={}))
+        self.ending = '_{0}.dat'.format (suffix) if suffix else '.dat'
+        self.f = None
+
+    @property
+    def filename (self):
+        outfile = '{0}{1}'.format (self.select.outfile_base, self.ending)
+        if self.select.opts.n_events:
+            outfile = '{0}_{1:05d}'.format (outfile, self.state['file'])
+        return outfile
+
+    def _open (self):
+        outfile = self.filename
+        sizes = self.state['sizes']
+        if outfile in sizes and os.path.isfile (outfile):
+            with open (outfile, 'r+b') as f:
+                f.truncate (sizes[outfile])
+            mode = 'ab'
+        else:
+            mode = 'wb'
+        self.f = gzip.GzipFile (outfile, mode)
+
+    def write (self, binary):
+        if self.f is None:
+            self._open ()
+        self.f.write (binary)
+        self.state['n'] += 1
+        if self.state['n'] == self.select.opts.n_events:
+            self.close ()
+            self.state['file'] += 1
+            self.state['n'] = 0
+
+    def close (self):
+        if self.f is not None:
+            self.f.close ()
+            self.f = None
+            outfile = self.filename
+            self.state['sizes'][outfile] = os.path.getsize (outfile)
+
+    def touch (self):
+        """Make sure the output file exists, even if nothing was kept."""
+        if not os.path.isfile (self.filename):
+            self._open ()
+            self.close ()
 
 if __name__ == '__main__':
     Select ().run ()
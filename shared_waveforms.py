@@ -0,0 +1,141 @@
+# shared_waveforms.py
+
+"""Calibrated waveforms of a run in shared memory for worker processes.
+
+SharedRun.create() decodes (part of) a run once into two
+multiprocessing.shared_memory blocks: a store_header_dtype header table and a
+float (event, channel, dda, sample) waveform array.  Workers attach to them
+by name with SharedRun.attach(spec) and read the arrays without copying or
+pickling any waveforms.
+
+Events with fewer readout blocks are zero-padded; the valid length of event
+i is headers['nblk'][i] // 4 * 64 samples.
+
+"""
+
+import itertools
+import multiprocessing
+import numpy as np
+
+from multiprocessing import shared_memory
+
+import aradecode
+
+
+class SharedRun(object):
+    def __init__(self, spec, blocks, owner=False):
+        self.spec = spec
+        self._blocks = blocks
+        self._owner = owner
+        header_shm, waveform_shm = blocks
+        self.headers = np.ndarray(
+            (spec['n_events'],), aradecode.store_header_dtype,
+            buffer=header_shm.buf)
+        self.waveforms = np.ndarray(
+            tuple(spec['shape']), spec['dtype'], buffer=waveform_shm.buf)
+
+    @classmethod
+    def create(cls, filename, cal, channels=range(8), start=0, stop=None,
+               tcal=None, dtype='float32'):
+        """Decode events [start, stop) of filename into shared memory.
+
+        The array is sized from a header-only scan; events are then decoded
+        and calibrated one at a time into it.
+
+        Parameters
+        ----------
+        filename : str
+            a .dat file (gzipped or not)
+        cal : ped_cal
+        channels : sequence of int
+        start, stop : int
+            event index range, as in a slice
+        tcal : time_cal
+            optional timing calibration
+        dtype : str
+            waveform dtype
+        """
+        headers = aradecode.read_headers(filename)
+        start, stop, _ = slice(start, stop).indices(len(headers))
+        headers = headers[start:stop]
+        channels = list(channels)
+        n_samples = int(headers['nblk'].max()) // 4 * 64 if len(headers) else 0
+        shape = (len(headers), len(channels), 4, n_samples)
+        dtype = np.dtype(dtype)
+        header_shm = shared_memory.SharedMemory(
+            create=True,
+            size=max(1, len(headers) * aradecode.store_header_dtype.itemsize))
+        waveform_shm = shared_memory.SharedMemory(
+            create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        spec = dict(header_name=header_shm.name,
+                    waveform_name=waveform_shm.name,
+                    n_events=len(headers), shape=shape, dtype=dtype.str,
+                    channels=channels, filename=filename, start=start)
+        run = cls(spec, (header_shm, waveform_shm), owner=True)
+        run.headers[...] = headers
+        run.waveforms[...] = 0
+        # one event at a time, straight into shared memory
+        stream = aradecode.ara_pipelined_stream(
+            aradecode.open_ara_file(filename),
+            types=(aradecode.atri_event_type,))
+        events = (ev for ev in stream if isinstance(ev, aradecode.atri_event))
+        try:
+            for i, ev in enumerate(itertools.islice(events, start, stop)):
+                w = ev.get_waveforms(cal, channels, tcal=tcal)
+                run.waveforms[i, ..., :w.shape[-1]] = w
+        finally:
+            stream.close()
+        return run
+
+    @classmethod
+    def attach(cls, spec):
+        """Attach to a SharedRun created elsewhere, given its spec."""
+        blocks = (shared_memory.SharedMemory(name=spec['header_name']),
+                  shared_memory.SharedMemory(name=spec['waveform_name']))
+        return cls(spec, blocks)
+
+    def __len__(self):
+        return self.spec['n_events']
+
+    def close(self):
+        """Detach; the creator also frees the shared memory."""
+        self.headers = self.waveforms = None
+        for shm in self._blocks:
+            shm.close()
+            if self._owner:
+                shm.unlink()
+        self._blocks = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_worker = {}
+
+
+def _init_worker(spec, func):
+    _worker['run'] = SharedRun.attach(spec)
+    _worker['func'] = func
+
+
+def _call_worker(index):
+    run = _worker['run']
+    return _worker['func'](run.headers[index], run.waveforms[index])
+
+
+def pool_map(func, run, processes=None, chunksize=16):
+    """Return [func(headers[i], waveforms[i]) for every event], in parallel.
+
+    func must be picklable (e.g. a module-level function); each worker
+    attaches to run once and receives zero-copy views of its arrays.
+    """
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(run.spec, func))
+    try:
+        return pool.map(_call_worker, range(len(run)), chunksize)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# synth_data.py
+
+
+from __future__ import print_function
+
+__doc__ = """Generate synthetic ARA station data and matching pedestals.
+
+Events consist of pedestal-level samples plus Gaussian noise, and every so
+often an impulsive, dispersed signal seen in all channels.  The files are
+laid out exactly like DAQ output, so they can be read by aradecode,
+pyaradisplay and select_events.
+"""
+
+import gzip
+import numpy as np
+import optparse
+
+from struct import pack
+
+import aradecode
+
+
+def make_pedestals (seed=0):
+    """Return a random but smooth-ish 4x512x8x64 pedestal table."""
+    rng = np.random.RandomState (seed)
+    base = rng.normal (1800, 40, size=(4, 1, 8, 1))
+    ped = base + rng.normal (0, 15, size=(4, 512, 8, 64))
+    return np.round (ped).astype (int)
+
+def write_pedestals (filename, ped):
+    """Write ped in the text format read by aradecode.ped_cal."""
+    cal = aradecode.ped_cal ()
+    cal.ped[...] = ped
+    cal.write (filename)
+
+def _impulse (rng, n):
+    t = np.arange (n) / 3.2
+    t0 = rng.uniform (.2, .6) * t.max ()
+    dt = np.clip (t - t0, 0, None)
+    f = rng.uniform (.15, .4)
+    return np.where (t >= t0,
+            np.exp (-dt / 8.) * np.sin (2 * np.pi * f * dt), 0)
+
+def make_event (rng, ped, event_id, unix, unix_us, station_id=2, nblk=32,
+        masks=(0xff, 0xff, 0xff, 0xff), noise=20., signal=0.):
+    """Return the binary blob for one synthetic event.
+
+    masks gives the channel mask for each of the four DDAs; signal is the
+    peak amplitude (in ADC counts) of an impulse added to every channel.
+    """
+    start = rng.randint (512)
+    n_per_dda = nblk // 4
+    pulse = signal * _impulse (rng, 64 * n_per_dda) if signal else None
+    trigger_info = (1 << rng.randint (3), 0, 0, 0)
+    trigger_blk = tuple (rng.randint (n_per_dda, size=4))
+    parts = []
+    for i in range (nblk):
+        dda = i % 4
+        irs_blk = (start + i // 4) % 512
+        mask = masks[dda]
+        parts.append (pack ('<2h', irs_blk, mask))
+        chans = [ch for ch in range (8) if mask >> ch & 1]
+        samples = ped[dda, irs_blk, :len (chans)] \
+                + rng.normal (0, noise, size=(len (chans), 64))
+        if pulse is not None:
+            k = i // 4
+            samples += pulse[64*k:64*k+64]
+        parts.append (np.round (samples).astype ('<i2').tobytes ())
+    body = pack ('<q6i2h', unix, unix_us, event_id, 0,
+            int (1e8 * 1e-6 * unix_us), unix % 65536, event_id, 1, nblk) \
+            + pack ('<4i', *trigger_info) + pack ('4B', *trigger_blk) \
+            + b''.join (parts)
+    nbytes = 16 + len (body)
+    return pack ('<4Bi', 1, station_id, 1, 0, nbytes) + bytes (8) + body
+
+def write_dat (filename, ped, n_events=100, station_id=2, nblk=32,
+        masks=(0xff, 0xff, 0xff, 0xff), gzipped=True, rate=5.,
+        signal_fraction=.1, seed=0, t0=1500000000):
+    """Write n_events synthetic events to filename; return bytes written."""
+    rng = np.random.RandomState (seed)
+    times = t0 + np.cumsum (rng.exponential (1. / rate, size=n_events))
+    blobs = []
+    for event_id, t in enumerate (times):
+        signal = rng.uniform (100, 600) \
+                if rng.uniform () < signal_fraction else 0
+        blobs.append (make_event (rng, ped, event_id,
+            int (t), int (1e6 * (t % 1)), station_id=station_id, nblk=nblk,
+            masks=masks, signal=signal))
+    data = b''.join (blobs)
+    f = gzip.GzipFile (filename, 'wb') if gzipped else open (filename, 'wb')
+    with f:
+        f.write (data)
+    return len (data)
+
+
+def main ():
+    usage = '%prog {[options]} [data file] {[pedestals file]}'
+    parser = optparse.OptionParser (usage=usage, description=__doc__)
+    parser.add_option ('-n', '--n-events', dest='n_events',
+            default=100, type=int, metavar='N',
+            help='write N events')
+    parser.add_option ('-s', '--station', dest='station_id',
+            default=2, type=int, metavar='ID',
+            help='station id to write')
+    parser.add_option ('-b', '--nblk', dest='nblk',
+            default=32, type=int, metavar='N',
+            help='readout blocks per event (a multiple of 4)')
+    parser.add_option ('-m', '--masks', dest='masks',
+            default='0xff', metavar='MASK[,MASK,MASK,MASK]',
+            help='channel mask for all DDAs, or one per DDA')
+    parser.add_option ('-r', '--rate', dest='rate',
+            default=5., type=float, metavar='HZ',
+            help='mean event rate')
+    parser.add_option ('--signal-fraction', dest='signal_fraction',
+            default=.1, type=float, metavar='FRACTION',
+            help='fraction of events with an impulsive signal')
+    parser.add_option ('-u', '--uncompressed', dest='gzipped',
+            default=True, action='store_false',
+            help='do not gzip the data file')
+    parser.add_option ('--seed', dest='seed',
+            default=0, type=int, metavar='SEED',
+            help='random seed')
+
+    opts, args = parser.parse_args ()
+    if not 1 <= len (args) <= 2:
+        parser.error ('must provide a data file and optionally a '
+                'pedestals file')
+    if opts.nblk % 4:
+        parser.error ('--nblk must be a multiple of 4')
+    masks = [int (m, 0) for m in opts.masks.split (',')]
+    if len (masks) == 1:
+        masks *= 4
+    if len (masks) != 4:
+        parser.error ('--masks needs one or four values')
+
+    ped = make_pedestals (opts.seed)
+    if len (args) == 2:
+        write_pedestals (args[1], ped)
+        print ('Wrote pedestals to "{0}".'.format (args[1]))
+    write_dat (args[0], ped, n_events=opts.n_events,
+            station_id=opts.station_id, nblk=opts.nblk, masks=masks,
+            gzipped=opts.gzipped, rate=opts.rate,
+            signal_fraction=opts.signal_fraction, seed=opts.seed)
+    print ('Wrote {0} events to "{1}".'.format (opts.n_events, args[0]))
+
+
+if __name__ == '__main__':
+    main ()
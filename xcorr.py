@@ -0,0 +1,127 @@
+# xcorr.py
+
+"""Batched FFT cross-correlation of waveforms.
+
+All pairs of waveforms in an event (or in many events at once) are correlated
+with a single rfft of every waveform and a single irfft of every pair
+product.  Zero-padded FFT sizes and pair indices are cached per waveform
+length, and scipy.fft keeps its own plan cache.
+
+"""
+
+import functools
+import numpy as np
+import scipy.fft
+
+from aradecode import sample_rate
+
+
+@functools.lru_cache(maxsize=None)
+def fft_size(n):
+    """Return a fast FFT length for linear correlation of length-n inputs."""
+    return scipy.fft.next_fast_len(2 * n - 1, real=True)
+
+
+@functools.lru_cache(maxsize=None)
+def pair_indices(n_wf):
+    """Return index arrays (i, j), i < j, of all pairs of n_wf waveforms."""
+    i, j = np.triu_indices(n_wf, 1)
+    i.flags.writeable = j.flags.writeable = False
+    return i, j
+
+
+@functools.lru_cache(maxsize=None)
+def lags(n):
+    """Return the lags (in ns) matching cross_correlate() output."""
+    out = np.arange(-(n - 1), n) / sample_rate
+    out.flags.writeable = False
+    return out
+
+
+def cross_correlate(ws, normalize=True, workers=None):
+    """Cross-correlate all pairs of waveforms.
+
+    Parameters
+    ----------
+    ws : (..., n_wf, n) array
+        waveforms; any leading dimensions (e.g. events) are batched
+    normalize : bool
+        divide by the product of the waveform norms, so that a peak of 1
+        means identical shapes
+    workers : int
+        passed on to scipy.fft
+
+    Returns
+    -------
+    (..., n_pairs, 2n-1) array
+        element [..., p, k] is sum_t w_i(t + lag_k) w_j(t) for the pair
+        (i, j) = pair_indices(n_wf)[:, p], with lags(n) giving lag_k
+    """
+    ws = np.asarray(ws, float)
+    n_wf, n = ws.shape[-2:]
+    nfft = fft_size(n)
+    i, j = pair_indices(n_wf)
+    spectra = scipy.fft.rfft(ws, nfft, axis=-1, workers=workers)
+    xc = scipy.fft.irfft(spectra[...,i,:] * np.conj(spectra[...,j,:]),
+                         nfft, axis=-1, workers=workers)
+    xc = np.concatenate([xc[...,nfft-(n-1):], xc[...,:n]], axis=-1)
+    if normalize:
+        norms = np.sqrt(np.sum(ws**2, axis=-1))
+        denom = norms[...,i] * norms[...,j]
+        xc /= np.where(denom > 0, denom, 1)[...,None]
+    return xc
+
+
+def peaks(xc):
+    """Return the lag (ns) and value of the largest |correlation|.
+
+    Parameters
+    ----------
+    xc : (..., n_pairs, 2n-1) array
+        output of cross_correlate()
+
+    Returns
+    -------
+    peak_lag, peak_value : (..., n_pairs) arrays
+    """
+    n = (xc.shape[-1] + 1) // 2
+    k = np.argmax(np.abs(xc), axis=-1)
+    value = np.take_along_axis(xc, k[...,None], axis=-1)[...,0]
+    return lags(n)[k], value
+
+
+def pair_matrix(values, n_wf, diagonal=0., antisymmetric=False):
+    """Arrange per-pair values as (..., n_wf, n_wf) matrices."""
+    values = np.asarray(values)
+    i, j = pair_indices(n_wf)
+    out = np.full(values.shape[:-1] + (n_wf, n_wf), diagonal, values.dtype)
+    out[...,i,j] = values
+    out[...,j,i] = -values if antisymmetric else values
+    return out
+
+
+def correlate_events(events, cal, channels=range(8), batch_size=64,
+                     workers=None):
+    """Yield (events, peak_lag, peak_value) for batches of events.
+
+    Events are batched in groups of equal waveform length, so that each
+    batch costs one rfft/irfft pass.  Waveforms are ordered as in
+    atri_event.get_waveforms(cal, channels), flattened over (channel, dda).
+    """
+    batches = {}
+    def flush(key):
+        evs, wss = batches.pop(key)
+        xc = cross_correlate(np.array(wss), workers=workers)
+        peak_lag, peak_value = peaks(xc)
+        return evs, peak_lag, peak_value
+    for ev in events:
+        ws = ev.get_waveforms(cal, channels)
+        ws = ws.reshape(-1, ws.shape[-1])
+        key = ws.shape
+        evs, wss = batches.setdefault(key, ([], []))
+        evs.append(ev)
+        wss.append(ws)
+        if len(evs) == batch_size:
+            yield flush(key)
+    for key in list(batches):
+        yield flush(key)